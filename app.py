@@ -1,233 +1,415 @@
-from flask import Flask, request, jsonify
-import datetime
-import json
+from flask import Flask, request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import HTTPException
 import asyncio
-import traceback
+import datetime
+import functools
+import io
+import time
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import orjson
 from datetime import timezone 
 
-from config import DISCORD_WEBHOOK_URL
-from helpers import _to_float
+from config import DISCORD_WEBHOOK_URL, DECISION_CACHE_TTL, ALERT_COOLDOWN, USE_ENSEMBLE, MAX_PENDING_ALERTS, MAX_UPLOAD_BYTES
+from helpers import _to_float, parse_alert, decision_fingerprint, normalize_alert, screen_alert, ignore_decision, TTLCache, save_recommendation_to_db, TREND_STRATEGY_RE
 from discord_helper import send_to_discord
-from trading_ensemble import TradingEnsemble
-from backtest_processor import process_backtest_data
+from backtest_processor import process_backtest_data, PROCESSING_ERRORS
 from market_hours_manager import MarketHoursManager
+from async_loop import submit_async
+
+# Handlers on the request path only enqueue records; a listener thread does the
+# actual stderr writes
+_log_queue = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), handlers=[logging.handlers.QueueHandler(_log_queue)])
+logger = logging.getLogger("tvhook")
 
 # Initialize services
 market_mgr = MarketHoursManager()
-trading_ensemble = TradingEnsemble() 
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, used by jsonify and request.get_json"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+def json_response(obj, status=200):
+    """JSON response serialized straight to bytes by orjson, skipping jsonify's str round trip"""
+    return app.response_class(orjson.dumps(obj), status=status, mimetype="application/json")
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
+
+# Emoji lookups for the ensemble summary
+DIRECTION_EMOJI = {"LONG": "🟢", "SHORT": "🔴", "IGNORE": "⚫"}
+CONFIDENCE_EMOJI = {"HIGH": "🔥", "MEDIUM": "⚠️", "LOW": "💤"}
+
+# Ensemble summaries are capped below Discord's 2000-char message limit
+MAX_SUMMARY_CHARS = 1900
+
+# (epoch second, (output, result)) from the last check_market_status call
+_market_status_cache = (0, None)
+
+# Static response bodies for the root and health endpoints
+_ROOT_BODY = b"TV webhook running.\n"
+_HEALTH_PREFIX = b'{"ok":true,"service":"TradingView Agent - Ensemble Model","timestamp":"'
+_HEALTH_SUFFIX = b'"}'
+
+# (epoch second, body) of the last /health response
+_health_body = (0, b"")
+
+# Fixed /tvhook replies, serialized once instead of through jsonify per alert
+_QUEUED_BODY = b'{"ok":true,"queued":true}'
+_BUSY_BODY = b'{"ok":false,"error":"busy"}'
+
+# "HH:MM" for every minute of the day, indexed by hour * 60 + minute
+_HHMM = [f"{h:02d}:{m:02d}" for h in range(24) for m in range(60)]
+
+# Caps alerts queued or being processed in the background
+_alert_slots = threading.BoundedSemaphore(MAX_PENDING_ALERTS)
+
+# Recent agent decisions keyed by decision_fingerprint. Repeats inside ALERT_COOLDOWN
+# are dropped; ones after it at the same levels are served from here instead of
+# paying for another model call. Only touched from the shared event loop.
+_decision_cache = TTLCache(maxsize=1024, ttl=DECISION_CACHE_TTL)
+_decisions_in_flight = {}
+
+# (ticker, strategy, interval) keys whose decision started within the last ALERT_COOLDOWN seconds
+_recent_alerts = TTLCache(maxsize=4096, ttl=ALERT_COOLDOWN)
 
 def startup_tasks():
     """Run startup tasks"""
-    print("🚀 Starting up...")
+    logger.info("🚀 Starting up...")
     from helpers import test_supabase_connection
     test_supabase_connection()
 
 def check_market_status():
-    """Check market hours and return appropriate status"""
+    """Check market hours and return appropriate status (cached per second)"""
+    global _market_status_cache
+    now = int(time.time())
+    cached_second, cached_value = _market_status_cache
+    if cached_second == now:
+        return cached_value
+    
     result = market_mgr.check_market_hours()
     
-    current_time_display = datetime.datetime.now().strftime("%H:%M")
+    local_time = time.localtime(now)
+    current_time_display = _HHMM[local_time.tm_hour * 60 + local_time.tm_min]
     output = f"Market Hours Manager APP {current_time_display}\n\n"
     output += result['display_format']
     
+    # Replace the whole tuple so concurrent readers never see a half update
+    _market_status_cache = (now, (output, result))
     return output, result
 
+@functools.lru_cache(maxsize=None)
+def get_ensemble():
+    """Import the ensemble (and its SDK clients) on first use"""
+    from trading_ensemble import ensemble
+    return ensemble
+
+async def get_cached_decision(alert_data, decide, cacheable):
+    """Run decide(alert_data), reusing a recent decision for an equivalent alert.
+    Returns (decision, fresh); fresh is False when no model call was made."""
+    key = decision_fingerprint(alert_data)
+    cooldown_key = _cooldown_key(alert_data)
+    decision = _decision_cache.get(key)
+    logger.info("♻️ Decision cache_hit=%s for %s", decision is not None, key[0])
+    if decision is not None:
+        # A re-served decision restarts the cooldown like a new one
+        _recent_alerts.set(cooldown_key, True)
+        return decision, False
+    
+    # Concurrent duplicates wait on the call already in flight
+    in_flight = _decisions_in_flight.get(key)
+    if in_flight is not None:
+        return await asyncio.shield(in_flight), False
+    
+    # Claim the cooldown as the call starts so near-duplicates arriving meanwhile are dropped
+    _recent_alerts.set(cooldown_key, True)
+    in_flight = asyncio.ensure_future(decide(alert_data))
+    _decisions_in_flight[key] = in_flight
+    try:
+        decision = await in_flight
+    except BaseException:
+        _recent_alerts.pop(cooldown_key)
+        raise
+    finally:
+        del _decisions_in_flight[key]
+    
+    if cacheable(decision):
+        _decision_cache.set(key, decision)
+    else:
+        # A failed call leaves the next alert free to retry
+        _recent_alerts.pop(cooldown_key)
+    return decision, True
+
+async def get_cached_ensemble_decision(alert_data):
+    """Get (ensemble decision, fresh), cached unless the ensemble failed"""
+    return await get_cached_decision(
+        alert_data, get_ensemble().get_ensemble_decision, lambda d: d.get("success")
+    )
+
 async def get_agent_decision(alert_data):
-    """Get trading decision from ensemble of 3 AI models"""
+    """Get (reply, fresh) from the ensemble of 3 AI models (or the single model when USE_ENSEMBLE=0)"""
+    if not USE_ENSEMBLE:
+        return await get_single_model_decision(alert_data)
+    
     try:
-        ensemble_decision = await trading_ensemble.get_ensemble_decision(alert_data)
+        ensemble_decision, fresh = await get_cached_ensemble_decision(alert_data)
         
         # Extract alert info
         ticker = alert_data.get('ticker', alert_data.get('symbol', 'UNKNOWN'))
         strategy = alert_data.get('strategy', alert_data.get('pattern', ''))
         price = alert_data.get('price', alert_data.get('close', alert_data.get('current_price', 'N/A')))
         
+        buf = io.StringIO()
+        # One spare char past the limit so truncation below can tell it overflowed
+        remaining = MAX_SUMMARY_CHARS + 1
+        
+        def append(text):
+            nonlocal remaining
+            if remaining > 0:
+                text = text[:remaining]
+                buf.write(text)
+                remaining -= len(text)
+        
         # ✅ COMBINED FORMAT - Full breakdown always shown
-        formatted_output = f"## 🎯 {ticker} {strategy}\n\n"
+        append(f"## 🎯 {ticker} {strategy}\n\n")
         
         # Decision with emoji
-        direction_emoji = {"LONG": "🟢", "SHORT": "🔴", "IGNORE": "⚫"}
-        confidence_emoji = {"HIGH": "🔥", "MEDIUM": "⚠️", "LOW": "💤"}
-        
-        formatted_output += f"{direction_emoji.get(ensemble_decision['direction'], '⚫')} **Decision**: {ensemble_decision['direction']}\n"
-        formatted_output += f"{confidence_emoji.get(ensemble_decision['confidence'], '💤')} **Confidence**: {ensemble_decision['confidence']}\n"
-        formatted_output += f"💰 **Price**: ${price}\n"
-        formatted_output += f"🤝 **Consensus**: {len(ensemble_decision['model_details'])}/3 models\n\n"
+        append(f"{DIRECTION_EMOJI.get(ensemble_decision['direction'], '⚫')} **Decision**: {ensemble_decision['direction']}\n")
+        append(f"{CONFIDENCE_EMOJI.get(ensemble_decision['confidence'], '💤')} **Confidence**: {ensemble_decision['confidence']}\n")
+        append(f"💰 **Price**: ${price}\n")
+        append(f"🤝 **Consensus**: {len(ensemble_decision['model_details'])}/3 models\n\n")
         
-        formatted_output += "### 📊 Ensemble Analysis\n"
-        formatted_output += f"{ensemble_decision['reasoning']}\n\n"
+        append("### 📊 Ensemble Analysis\n")
+        append(f"{ensemble_decision['reasoning']}\n\n")
         
         # ✅ ALWAYS SHOW FULL MODEL BREAKDOWN
-        formatted_output += "### 🤖 Model Breakdown\n\n"
+        append("### 🤖 Model Breakdown\n\n")
         
         for i, model_decision in enumerate(ensemble_decision['model_details'], 1):
-            model_name = model_decision['model']
-            # Clean model names for display
-            if 'gpt-4o' in model_name:
-                display_name = "GPT-4o"
-            elif 'gpt-4-turbo' in model_name:
-                display_name = "GPT-4 Turbo"
-            elif 'claude' in model_name:
-                display_name = "Claude 3.5"
-            else:
-                display_name = model_name
-                
-            direction_emoji = {"LONG": "🟢", "SHORT": "🔴", "IGNORE": "⚫"}.get(model_decision['direction'], '⚫')
-            confidence_emoji = {"HIGH": "🔥", "MEDIUM": "⚠️", "LOW": "💤"}.get(model_decision['confidence'], '💤')
+            if remaining <= 0:
+                break
+            display_name = model_decision.get('display_name', model_decision['model'])
+            direction_emoji = DIRECTION_EMOJI.get(model_decision['direction'], '⚫')
+            confidence_emoji = CONFIDENCE_EMOJI.get(model_decision['confidence'], '💤')
             
-            formatted_output += f"**{i}. {display_name}**\n"
-            formatted_output += f"{direction_emoji} **Decision**: {model_decision['direction']} {confidence_emoji} **Confidence**: {model_decision['confidence']}\n"
-            formatted_output += f"**Reasoning**: {model_decision['reasoning']}\n\n"
+            append(f"**{i}. {display_name}**\n")
+            append(f"{direction_emoji} **Decision**: {model_decision['direction']} {confidence_emoji} **Confidence**: {model_decision['confidence']}\n")
+            append(f"**Reasoning**: {model_decision['reasoning']}\n\n")
         
         # Add consensus breakdown
         direction_counts = ensemble_decision.get('consensus_breakdown', {})
         if direction_counts:
-            formatted_output += "### 🗳️ Consensus Breakdown\n"
+            append("### 🗳️ Consensus Breakdown\n")
             for direction, count in direction_counts.items():
-                formatted_output += f"• **{direction}**: {count}/3 models\n"
+                append(f"• **{direction}**: {count}/3 models\n")
+        
+        formatted_output = buf.getvalue()
         
         # Check length and truncate if necessary (very unlikely but safe)
-        if len(formatted_output) > 1900:
-            formatted_output = formatted_output[:1897] + "..."
+        if len(formatted_output) > MAX_SUMMARY_CHARS:
+            formatted_output = formatted_output[:MAX_SUMMARY_CHARS - 3] + "..."
             
-        return formatted_output
+        return formatted_output, fresh
         
     except Exception as e:
-        print(f"❌ Ensemble error: {e}")
+        logger.error("❌ Ensemble error: %s", e)
         # Simple fallback that doesn't break formatting
-        return f"## ⚠️ System Update\n\nEnsemble analysis temporarily unavailable.\n\n*Error: {str(e)[:100]}...*"
+        return f"## ⚠️ System Update\n\nEnsemble analysis temporarily unavailable.\n\n*Error: {str(e)[:100]}...*", True
 
-@app.route("/", methods=["GET", "POST"])
-def root():
-    return "TV webhook running.\n", 200
+def _is_agent_error(decision):
+    """True for the ignore fallback the OpenAI agent returns when its call failed"""
+    return str(decision.get("notes", "")).startswith("OpenAI error")
 
-@app.route("/health", methods=["GET", "HEAD"])
-def health_check():
-    return jsonify({
-        "ok": True,
-        "service": "TradingView Agent - Ensemble Model",
-        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat()  # FIXED
-    }), 200
+async def get_single_model_decision(alert_data):
+    """Get (decision, fresh) from the single-model OpenAI agent (JSON reply), cached unless the call failed"""
+    from openai_agent import get_agent_decision as get_openai_decision
+    return await get_cached_decision(
+        alert_data, get_openai_decision, lambda d: not _is_agent_error(d)
+    )
 
-@app.route("/tvhook", methods=["POST"])
-def tvhook():
-    """Main webhook endpoint for TradingView alerts."""
-    print("=== 🚨 TVHOOK ENDPOINT TRIGGERED ===")
-    
-    try:
-        data = request.get_json(force=True)
-        print(f"✅ JSON parsed successfully: {type(data)}")
-    except Exception as e:
-        print(f"❌ JSON Error: {e}")
-        print(f"❌ Raw request data: {request.data}")
-        return jsonify({"ok": False, "error": "bad_json"}), 400
+async def deliver_decision(alert_data, agent_reply, save=True):
+    """Post the decision to Discord and save it to the database in parallel"""
+    if not save:
+        # Decisions re-served from the cache were saved when first made
+        discord_result = await send_to_discord(alert_data, agent_reply)
+        logger.info("📢 DISCORD SEND RESULT: %s", discord_result)
+        return
+    discord_result, db_result = await asyncio.gather(
+        send_to_discord(alert_data, agent_reply),
+        asyncio.to_thread(save_recommendation_to_db, alert_data, agent_reply)
+    )
+    logger.info("📢 DISCORD SEND RESULT: %s", discord_result)
+    logger.info("💾 DATABASE SAVE RESULT: %s", db_result)
 
-    if not data:
-        print("⚠️ Empty payload received")
-        return jsonify({"ok": False, "error": "empty_payload"}), 400
+def _cooldown_key(alert_data):
+    """(ticker, strategy, interval) key for the alert cooldown"""
+    return (
+        str(alert_data.get('ticker', alert_data.get('symbol', ''))).upper(),
+        str(alert_data.get('strategy', alert_data.get('pattern', ''))),
+        str(alert_data.get('interval', ''))
+    )
 
-    print(f"🔥 ALERT DATA RECEIVED: {data}")
-    print(f"🔥 FULL ALERT DETAILS: {json.dumps(data, indent=2)}")
+def check_cooldown(alert_data):
+    """Return a skip reason if the same ticker/strategy/interval was analyzed within ALERT_COOLDOWN"""
+    key = _cooldown_key(alert_data)
+    if _recent_alerts.get(key):
+        return f"Cooldown: {key[0]} {key[1]} already analyzed in the last {ALERT_COOLDOWN}s"
+    return None
 
+async def process_alert(data):
+    """Check market hours, get the agent decision, then post and save it"""
     try:
+        # Coerce fields once; everything downstream gets the normalized copy
+        data = normalize_alert(data)
+        
         # Check market hours
-        print("📊 Checking market status...")
+        logger.debug("📊 Checking market status...")
         market_output, market_result = check_market_status()
-        print(f"📊 MARKET STATUS: {market_output}")
-        print(f"📊 MARKET RESULT: {market_result}")
-        
-        agent_reply = ""
+        logger.debug("📊 MARKET STATUS: %s", market_output)
+        logger.debug("📊 MARKET RESULT: %s", market_result)
         
         # Only process trades if markets are open
         if market_result['status'] in ['TRADING_BOT_STARTED', 'WITHIN_MARKET_HOURS']:
-            print("✅ Markets are open - processing trade...")
+            logger.info("✅ Markets are open - processing trade...")
             
             # ✅ ADDED: Log the strategy type for debugging
             strategy = data.get('strategy', 'unknown')
-            print(f"📊 PROCESSING STRATEGY: {strategy}")
+            logger.info("📊 PROCESSING STRATEGY: %s", strategy)
             
             # ✅ ADDED: Check if this is a trend analysis alert
-            if any(x in strategy for x in ['bullish_trend', 'bearish_trend']):
-                print(f"🎯 TREND ANALYSIS ALERT DETECTED: {strategy}")
+            if TREND_STRATEGY_RE.search(strategy):
+                logger.info("🎯 TREND ANALYSIS ALERT DETECTED: %s", strategy)
                 # Extract trend-specific data for logging
-                additional_data = data.get('additional_data', {})
+                additional_data = data.get('additional_data') or {}
                 trend_strength = additional_data.get('trend_strength', 'unknown')
                 conditions_met = additional_data.get('conditions_met', 'unknown')
                 etf_mode = additional_data.get('etf_mode', False)
-                print(f"📈 TREND DETAILS - Strength: {trend_strength}, Conditions: {conditions_met}, ETF Mode: {etf_mode}")
+                logger.info("📈 TREND DETAILS - Strength: %s, Conditions: %s, ETF Mode: %s", trend_strength, conditions_met, etf_mode)
             
-            # Get ensemble decision
-            print("🤖 Getting agent decision...")
-            agent_reply = asyncio.run(get_agent_decision(data))
-            print(f"🤖 AGENT REPLY: {agent_reply}")
-            print(f"🤖 AGENT REPLY TYPE: {type(agent_reply)}")
-            
-            # Send to Discord
-            print("📢 Attempting to send to Discord...")
-            discord_result = send_to_discord(data, agent_reply)
-            print(f"📢 DISCORD SEND RESULT: {discord_result}")
+            # Settle trivially bad setups without a model call
+            skip_reason = screen_alert(data)
+            cooldown_reason = None if skip_reason else check_cooldown(data)
+            fresh = True
+            if skip_reason:
+                logger.info("⏭️ Skipping agent: %s", skip_reason)
+                agent_reply = ignore_decision(skip_reason)
+            elif cooldown_reason:
+                # Repeats are dropped outright so they never reach Discord or the learning table
+                logger.info("⏭️ Dropping duplicate alert: %s", cooldown_reason)
+                agent_reply = None
+            else:
+                logger.debug("🤖 Getting agent decision...")
+                agent_reply, fresh = await get_agent_decision(data)
+            logger.debug("🤖 AGENT REPLY: %s", agent_reply)
             
-            # Save to database
-            print("💾 Attempting to save to database...")
-            db_result = save_recommendation_to_db(data, agent_reply)
-            print(f"💾 DATABASE SAVE RESULT: {db_result}")
+            if agent_reply is not None:
+                await deliver_decision(data, agent_reply, save=fresh)
             
         else:
             agent_reply = "MARKETS_CLOSED: No trade processing outside market hours (9:00 AM - 4:00 PM ET)"
-            print(f"⏸️ {agent_reply}")
-            print("📢 Attempting to send market closed message to Discord...")
-            discord_result = send_to_discord(data, agent_reply)
-            print(f"📢 DISCORD SEND RESULT: {discord_result}")
-
-        # Return response - handle JSON parsing safely
-        print("🔄 Preparing response...")
-        try:
-            # Try to parse as JSON, if not just return as raw text
-            parsed = json.loads(agent_reply)
-            print("✅ Agent reply parsed as JSON successfully")
-        except Exception as parse_error:
-            print(f"⚠️ Agent reply is not JSON, returning as raw text: {parse_error}")
-            parsed = {"raw": agent_reply}
-
-        print(f"✅ FINAL RESPONSE: {json.dumps({'ok': True, 'agent': parsed}, indent=2)}")
-        print("=== 🏁 TVHOOK PROCESSING COMPLETE ===\n")
-        return jsonify({"ok": True, "agent": parsed})
+            logger.info("⏸️ %s", agent_reply)
+            await send_to_discord(data, agent_reply)
+
+        logger.info("=== 🏁 TVHOOK PROCESSING COMPLETE ===")
 
     except Exception as e:
-        print(f"❌ CRITICAL ERROR in tvhook: {e}")
-        print(f"❌ FULL TRACEBACK: {traceback.format_exc()}")
-        
-        # Try to send error to Discord for visibility
-        try:
-            error_message = f"❌ CRITICAL ERROR in webhook: {str(e)}"
-            discord_result = send_to_discord({"error": True}, error_message)
-            print(f"📢 ERROR SENT TO DISCORD: {discord_result}")
-        except Exception as discord_error:
-            print(f"❌ FAILED TO SEND ERROR TO DISCORD: {discord_error}")
-            
-        print("=== 💥 TVHOOK PROCESSING FAILED ===\n")
-        return jsonify({"ok": False, "error": f"Processing error: {str(e)}"}), 500
+        logger.exception("❌ CRITICAL ERROR in tvhook: %s", e)
+        await send_to_discord({"error": True}, f"❌ CRITICAL ERROR in webhook: {str(e)}")
+        logger.info("=== 💥 TVHOOK PROCESSING FAILED ===")
+
+    finally:
+        _alert_slots.release()
+
+@app.route("/", methods=["GET", "POST"])
+def root():
+    return app.response_class(_ROOT_BODY, mimetype="text/plain")
+
+@app.route("/health", methods=["GET", "HEAD"])
+def health_check():
+    # Uptime pingers hit this constantly; the body only changes once a second
+    global _health_body
+    now = int(time.time())
+    if _health_body[0] != now:
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(now)).encode()
+        _health_body = (now, _HEALTH_PREFIX + timestamp + _HEALTH_SUFFIX)
+    return app.response_class(_health_body[1], mimetype="application/json")
+
+@app.route("/tvhook", methods=["POST"])
+def tvhook():
+    """Main webhook endpoint for TradingView alerts."""
+    logger.info("=== 🚨 TVHOOK ENDPOINT TRIGGERED ===")
+    
+    # Not cached on the request: the parsed alert is all we keep
+    raw = request.get_data(cache=False)
+    try:
+        data = parse_alert(raw)
+        logger.debug("✅ JSON parsed successfully: %s", type(data))
+    except Exception as e:
+        logger.warning("❌ JSON Error: %s", e)
+        logger.debug("❌ Raw request data: %s", raw)
+        return json_response({"ok": False, "error": "bad_json"}, 400)
+
+    if not data:
+        logger.warning("⚠️ Empty payload received")
+        return json_response({"ok": False, "error": "empty_payload"}, 400)
+
+    logger.info("🔥 ALERT DATA RECEIVED: %s", data)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("🔥 FULL ALERT DETAILS: %s", orjson.dumps(data, option=orjson.OPT_INDENT_2).decode())
+
+    if not _alert_slots.acquire(blocking=False):
+        logger.warning("⚠️ Too many alerts in flight - dropping alert: %s", data)
+        return app.response_class(_BUSY_BODY, status=503, mimetype="application/json")
+
+    # Agent call, Discord post and DB save all happen after we answer TradingView
+    submit_async(process_alert(data))
+    return app.response_class(_QUEUED_BODY, status=202, mimetype="application/json")
+
+@app.errorhandler(Exception)
+def handle_unexpected_error(e):
+    """Log unhandled errors, report them to Discord in the background and return JSON"""
+    if isinstance(e, HTTPException):
+        return e
+    
+    logger.exception("❌ CRITICAL ERROR in %s: %s", request.path, e)
+    submit_async(send_to_discord({"error": True}, f"❌ CRITICAL ERROR in webhook: {str(e)}"))
+    return json_response({"ok": False, "error": f"Processing error: {str(e)}"}, 500)
 
 @app.route("/backtest", methods=["POST"])
 def backtest():
     """Process backtest data uploads."""
     ticker_hint = request.args.get("ticker", "").upper().strip()
     content_type = request.headers.get("Content-Type", "")
-    raw_data = request.data
 
-    result, error = process_backtest_data(raw_data, content_type, ticker_hint)
+    # Read the upload straight from the socket instead of buffering request.data
+    result, error = process_backtest_data(request.stream, content_type, ticker_hint, request.content_length)
     
     if error:
-        return jsonify({"ok": False, "error": error}), 400
+        return json_response({"ok": False, "error": error}, 503 if error in PROCESSING_ERRORS else 400)
 
-    return jsonify({"ok": True, "summary": result}), 200
+    return json_response({"ok": True, "summary": result})
 
 @app.route("/debug", methods=["GET"])
 def debug():
     """Debug endpoint to check system status"""
-    return jsonify({
+    return json_response({
         "status": "ok",
         "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
         "market_hours": market_mgr.check_market_hours(),
@@ -235,6 +417,6 @@ def debug():
     })
 
 if __name__ == "__main__":
-    import os
+    # Local development only; production runs gunicorn -c gunicorn.conf.py app:app
     port = int(os.environ.get("PORT", "10000"))
     app.run(host="0.0.0.0", port=port)
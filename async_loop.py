@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+import httpx
+from config import OPENAI_RPM, OPENAI_TPM, WEB_CONCURRENCY
+
+try:
+    import uvloop
+except ImportError:  # optional: fall back to the stdlib loop
+    uvloop = None
+
+logger = logging.getLogger(__name__)
+
+# One event loop per process, running in a daemon thread. Flask handlers hand
+# coroutines to it instead of building and tearing down a loop per request.
+_loop = None
+_loop_lock = threading.Lock()
+
+# Connection pool shared by the OpenAI, Anthropic and Discord calls made on that loop
+_http_client = None
+
+def get_loop():
+    """Return the shared event loop, starting it on first use."""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="async-loop", daemon=True)
+                thread.start()
+                _loop = loop
+    return _loop
+
+def get_http_client():
+    """Return the process-wide HTTP/2 client used for all outbound API calls."""
+    global _http_client
+    if _http_client is None:
+        with _loop_lock:
+            if _http_client is None:
+                _http_client = httpx.AsyncClient(
+                    http2=True,
+                    # Fail fast on connect; model replies can legitimately take a while
+                    timeout=httpx.Timeout(30.0, connect=3.0),
+                    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=30.0)
+                )
+    return _http_client
+
+class AsyncRateLimiter:
+    """Token bucket for outbound API calls on the shared loop.
+
+    `await limiter.acquire()` waits until a request slot is free. Callers report
+    usage with record_tokens(); once the rolling token count passes 80% of
+    max_tokens, new calls wait for old usage to age out of the window.
+    """
+
+    def __init__(self, max_rate, time_period=60.0, max_tokens=None):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self.max_tokens = max_tokens
+        self._level = 0.0
+        self._last_leak = time.monotonic()
+        self._token_log = deque()
+        self._tokens_in_window = 0
+
+    def _leak(self, now):
+        self._level = max(0.0, self._level - (now - self._last_leak) * self.max_rate / self.time_period)
+        self._last_leak = now
+        while self._token_log and self._token_log[0][0] <= now - self.time_period:
+            self._tokens_in_window -= self._token_log.popleft()[1]
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._leak(now)
+            if self.max_tokens and self._token_log and self._tokens_in_window > 0.8 * self.max_tokens:
+                delay = self._token_log[0][0] + self.time_period - now
+            elif self._level + 1 > self.max_rate:
+                delay = (self._level + 1 - self.max_rate) * self.time_period / self.max_rate
+            else:
+                self._level += 1
+                return
+            logger.info("⏳ Rate limit reached, waiting %.2fs", delay)
+            await asyncio.sleep(delay)
+
+    def record_tokens(self, tokens):
+        self._token_log.append((time.monotonic(), tokens))
+        self._tokens_in_window += tokens
+
+# Shared by every OpenAI call so bursts are smoothed before they turn into 429s.
+# The limits are account-wide, so this process only gets its worker's share
+openai_limiter = AsyncRateLimiter(
+    max(1, OPENAI_RPM // WEB_CONCURRENCY), 60.0, OPENAI_TPM // WEB_CONCURRENCY
+)
+
+def run_async(coro, timeout=None):
+    """Run a coroutine on the shared loop and block until it returns."""
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    return future.result(timeout)
+
+def submit_async(coro):
+    """Schedule a coroutine on the shared loop without waiting for it."""
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    future.add_done_callback(_log_background_failure)
+    return future
+
+def _log_background_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("❌ Background task failed: %s", future.exception())
@@ -1,111 +1,211 @@
-import json
-import csv
+import logging
+import concurrent.futures
 import io
-from helpers import _to_float, load_backtest_memory, save_backtest_memory
+import multiprocessing
+import threading
+from concurrent.futures.process import BrokenProcessPool
+import orjson
+import numpy as np
+import pandas as pd
+from helpers import load_backtest_memory, save_backtest_memory
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pacsv
+except ImportError:  # optional: fall back to pandas' C parser
+    pa = pacsv = None
+from config import BACKTEST_PROCESS_MIN_BYTES, BACKTEST_PROCESS_WORKERS, BACKTEST_PROCESS_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Started on first large upload; see process_backtest_data
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+# Every column summarize_trades reads; the rest of a TradingView export is never parsed
+_TICKER_COLUMNS = ["ticker", "Ticker"]
+_PATTERN_COLUMNS = ["pattern", "Pattern", "Signal"]
+_RUNUP_COLUMNS = ["Run-up %", "Run up %", "Run-up%"]
+_DRAWDOWN_COLUMNS = ["Drawdown %", "Drawdown%"]
+_USED_COLUMNS = frozenset(
+    _TICKER_COLUMNS + _PATTERN_COLUMNS + _RUNUP_COLUMNS + _DRAWDOWN_COLUMNS
+    + ["Net P&L USD", "Net P&L %"]
+)
+
+# Errors from the processing side rather than the upload itself
+PROCESSING_ERRORS = frozenset(("processing_timeout", "processing_failed"))
+
+# Summary record fields, in output order
+_SUMMARY_COLUMNS = ["ticker", "pattern", "total_trades", "wins", "losses", "winrate_pct", "avg_rr"]
+
+def _get_process_pool():
+    """Pool for large uploads. Spawned rather than forked: forking a threaded worker isn't safe."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=BACKTEST_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+def process_backtest_data(stream, content_type, ticker_hint="", content_length=None):
+    """Process a CSV or JSON backtest upload stream into (summary, error) and save it to memory."""
+    global _process_pool
+    if BACKTEST_PROCESS_MIN_BYTES and (content_length or 0) >= BACKTEST_PROCESS_MIN_BYTES:
+        # Big uploads are parsed and aggregated in another process so this
+        # worker's /tvhook threads aren't starved of the GIL meanwhile
+        pool = _get_process_pool()
+        try:
+            summary, error = pool.submit(summarize_upload, stream.read(), content_type, ticker_hint).result(
+                timeout=BACKTEST_PROCESS_TIMEOUT
+            )
+        except (concurrent.futures.TimeoutError, BrokenProcessPool) as e:
+            # A crashed or stuck child leaves the pool unusable; the next large upload starts a new one
+            logger.error("❌ Backtest processing failed after %s bytes: %r", content_length, e)
+            with _process_pool_lock:
+                if _process_pool is pool:
+                    _process_pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+            if isinstance(e, BrokenProcessPool):
+                return None, "processing_failed"
+            return None, "processing_timeout"
+    else:
+        summary, error = summarize_upload(stream, content_type, ticker_hint)
 
-def process_backtest_data(raw_data, content_type, ticker_hint=""):
-    """Process backtest data from CSV or JSON."""
-    rows = []
+    if error:
+        return None, error
+    return finalize_summary(summary), None
 
+def summarize_upload(stream, content_type, ticker_hint=""):
+    """Parse a CSV or JSON upload (stream or bytes) into (summary records, error)."""
+    if isinstance(stream, bytes):
+        stream = io.BytesIO(stream)
     if "application/json" in content_type:
         try:
-            payload = json.loads(raw_data.decode("utf-8"))
+            payload = orjson.loads(stream.read())
             if isinstance(payload, dict) and "trades" in payload:
                 rows = payload["trades"]
             elif isinstance(payload, list):
                 rows = payload
             else:
                 return None, "invalid_json_structure"
+            df = pd.DataFrame(rows)
         except Exception as e:
-            print("❌ JSON error:", e)
+            logger.error("❌ JSON error: %s", e)
             return None, "bad_json"
     else:
-        # CSV processing
+        # CSV processing - parsed straight off the stream, only the columns we
+        # use, every cell kept as text and coerced per column below
         try:
-            text = raw_data.decode("utf-8")
-            reader = csv.DictReader(io.StringIO(text))
-            rows = [r for r in reader]
+            df = _read_csv(stream)
+        except pd.errors.EmptyDataError:
+            return None, "no_rows"
         except Exception as e:
-            print("❌ CSV error:", e)
+            logger.error("❌ CSV error: %s", e)
             return None, "bad_csv"
 
-    if not rows:
+    if df.empty:
         return None, "no_rows"
 
-    return process_trades(rows, ticker_hint)
-
-def process_trades(rows, ticker_hint):
-    """Process and aggregate trade data."""
-    summary = {}
-
-    for r in rows:
-        row_ticker = (r.get("ticker") or r.get("Ticker") or ticker_hint or "UNKNOWN").upper()
-        pattern = (r.get("pattern") or r.get("Pattern") or r.get("Signal") or "").strip() or "unknown"
-        key = f"{row_ticker}:{pattern}"
-
-        if key not in summary:
-            summary[key] = {
-                "ticker": row_ticker,
-                "pattern": pattern,
-                "total_trades": 0,
-                "wins": 0,
-                "losses": 0,
-                "rr_values": []
-            }
-
-        rec = summary[key]
-        rec["total_trades"] += 1
-
-        # Determine win/loss
-        pl = None
-        if r.get("Net P&L USD") not in (None, ""):
-            pl = _to_float(r.get("Net P&L USD"))
-        elif r.get("Net P&L %") not in (None, ""):
-            pl = _to_float(r.get("Net P&L %"))
-
-        if pl is not None:
-            if pl > 0:
-                rec["wins"] += 1
-            elif pl < 0:
-                rec["losses"] += 1
-
-        # Compute R:R
-        runup = _to_float(r.get("Run-up %") or r.get("Run up %") or r.get("Run-up%"))
-        drawdown_raw = _to_float(r.get("Drawdown %") or r.get("Drawdown%"))
-
-        if runup is not None and drawdown_raw not in (None, 0) and runup > 0:
-            rr = runup / abs(drawdown_raw)
-            if 0 < rr < 20:
-                rec["rr_values"].append(rr)
-
-    return finalize_summary(summary)
-
-def finalize_summary(summary):
-    """Finalize summary statistics and save to memory."""
+    return summarize_trades(df, ticker_hint), None
+
+def _read_csv(stream):
+    """Read the used CSV columns as text, with pyarrow's multithreaded reader when installed."""
+    # pyarrow needs a real file object; raw server streams (chunked uploads) lack .closed
+    if pacsv is None or not isinstance(stream, io.IOBase):
+        return pd.read_csv(stream, dtype=str, keep_default_na=False,
+                           usecols=lambda name: name in _USED_COLUMNS)
+    try:
+        table = pacsv.read_csv(stream, convert_options=pacsv.ConvertOptions(
+            column_types={name: pa.string() for name in _USED_COLUMNS},
+            include_columns=list(_USED_COLUMNS),
+            include_missing_columns=True
+        ))
+    except pa.ArrowInvalid as e:
+        if str(e).startswith("Empty CSV"):
+            raise pd.errors.EmptyDataError(str(e)) from e
+        raise
+    # Columns the file doesn't have come back all-null; drop them so the frame
+    # matches the pandas path (and is empty when none of ours are present)
+    return table.to_pandas().dropna(axis=1, how="all")
+
+def _first_column(df, names):
+    """Per row, the first non-empty value among the given columns (NaN if none)."""
+    result = pd.Series(np.nan, index=df.index, dtype=object)
+    for name in names:
+        if name in df:
+            result = result.fillna(df[name].replace("", np.nan))
+    return result
+
+def _numeric(values):
+    """Vectorized _to_float: strip % signs, NaN for anything unparseable."""
+    values = values.infer_objects()
+    if pd.api.types.is_numeric_dtype(values):
+        # JSON uploads usually carry real numbers; no string round trip needed
+        return values.astype(float)
+    # Most cells parse as-is in C; only the rest ("12.5%", text) take the
+    # per-row string cleanup
+    parsed = pd.to_numeric(values, errors="coerce")
+    retry = parsed.isna() & values.notna()
+    if retry.any():
+        text = values[retry].astype(str).str.replace("%", "", regex=False).str.strip()
+        parsed[retry] = pd.to_numeric(text, errors="coerce")
+    return parsed
+
+def _per_distinct(values, clean):
+    """Apply a Series -> Series string cleanup once per distinct value instead of once per row."""
+    codes, uniques = pd.factorize(values)
+    return pd.Series(clean(pd.Series(uniques, dtype=object)).to_numpy()[codes], index=values.index)
+
+def summarize_trades(df, ticker_hint):
+    """Aggregate trade rows into per ticker/pattern summary records."""
+    trades = pd.DataFrame({
+        "ticker": _per_distinct(
+            _first_column(df, _TICKER_COLUMNS).fillna(ticker_hint or "UNKNOWN"),
+            lambda s: s.astype(str).str.upper()
+        ),
+        "pattern": _per_distinct(
+            _first_column(df, _PATTERN_COLUMNS).fillna(""),
+            lambda s: s.astype(str).str.strip().replace("", "unknown")
+        ),
+    })
+
+    # Win/loss from USD P&L, or % P&L when the USD column is empty
+    pl_usd = _first_column(df, ["Net P&L USD"])
+    pl = _numeric(pl_usd).where(pl_usd.notna(), _numeric(_first_column(df, ["Net P&L %"])))
+    trades["win"] = pl > 0
+    trades["loss"] = pl < 0
+
+    # R:R from run-up over drawdown, ignoring outliers
+    runup = _numeric(_first_column(df, _RUNUP_COLUMNS))
+    drawdown = _numeric(_first_column(df, _DRAWDOWN_COLUMNS)).abs()
+    rr = (runup / drawdown).where((runup > 0) & (drawdown > 0))
+    trades["rr"] = rr.where((rr > 0) & (rr < 20))
+
+    grouped = trades.groupby(["ticker", "pattern"], sort=False).agg(
+        total_trades=("win", "size"),
+        wins=("win", "sum"),
+        losses=("loss", "sum"),
+        avg_rr=("rr", "mean")
+    ).reset_index()
+
+    # Output columns finished in whole-column passes: win rate and rounded R:R
+    # (None where a group had no usable R:R)
+    grouped["winrate_pct"] = (grouped["wins"] / grouped["total_trades"] * 100).round(2)
+    avg_rr = grouped["avg_rr"].round(2)
+    grouped["avg_rr"] = avg_rr.astype(object).where(avg_rr.notna(), None)
+    return grouped[_SUMMARY_COLUMNS].to_dict("records")
+
+def finalize_summary(out):
+    """Save finished summary records to memory."""
+    # Only entries that actually changed are appended to the memory log
     memory = load_backtest_memory()
-    out = []
-
-    for key, rec in summary.items():
-        total = rec["total_trades"]
-        wins = rec["wins"]
-        losses = rec["losses"]
-
-        winrate = round((wins / total) * 100, 2) if total > 0 else 0
-        avg_rr = round(sum(rec["rr_values"]) / len(rec["rr_values"]), 2) if rec["rr_values"] else None
-
-        result = {
-            "ticker": rec["ticker"],
-            "pattern": rec["pattern"],
-            "total_trades": total,
-            "wins": wins,
-            "losses": losses,
-            "winrate_pct": winrate,
-            "avg_rr": avg_rr
-        }
-
-        out.append(result)
-        memory[key] = result
-
-    save_backtest_memory(memory)
-    print("📊 Backtest summary:", out)
+    changed = {
+        key: result
+        for key, result in ((f"{r['ticker']}:{r['pattern']}", r) for r in out)
+        if memory.get(key) != result
+    }
+    if changed:
+        save_backtest_memory(changed)
+    logger.info("📊 Backtest summary: %s", out)
     return out
@@ -2,7 +2,51 @@ import os
 
 # Discord Webhook
 DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL")
-BACKTEST_MEMORY_FILE = "backtest_memory.json"
+BACKTEST_MEMORY_FILE = "backtest_memory.jsonl"
+
+# Agent backend: the 3-model ensemble (default) or the single-model OpenAI agent
+USE_ENSEMBLE = os.getenv("USE_ENSEMBLE", "1") == "1"
+
+# Alerts allowed to wait for / run the agent at once before tvhook answers 503
+MAX_PENDING_ALERTS = int(os.getenv("MAX_PENDING_ALERTS", "32"))
+
+# Single-model mode: alerts arriving within this many seconds share one OpenAI call
+ALERT_BATCH_WINDOW = float(os.getenv("ALERT_BATCH_WINDOW", "0.3"))
+ALERT_BATCH_SIZE = int(os.getenv("ALERT_BATCH_SIZE", "8"))
+
+# OpenAI account limits; calls are throttled to stay under them. Each of the
+# WEB_CONCURRENCY gunicorn workers throttles on its own with an even share
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "30000"))
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "2")))
+
+# Prefilter: inside-bar ranges outside these fractions of price are ignored without
+# asking the agent; repeats of the same ticker/strategy within the cooldown are dropped
+MIN_IB_RANGE_PCT = float(os.getenv("MIN_IB_RANGE_PCT", "0.0005"))
+MAX_IB_RANGE_PCT = float(os.getenv("MAX_IB_RANGE_PCT", "0.02"))
+ALERT_COOLDOWN = int(os.getenv("ALERT_COOLDOWN", "60"))
+# ...and so are patterns whose backtest history (with enough trades) is below both bars
+HIST_MIN_TRADES = int(os.getenv("HIST_MIN_TRADES", "20"))
+HIST_MIN_WINRATE = float(os.getenv("HIST_MIN_WINRATE", "30"))
+HIST_MIN_AVG_RR = float(os.getenv("HIST_MIN_AVG_RR", "1.5"))
+
+# Seconds an agent decision is reused for a repeated (identical) alert. Repeats
+# inside ALERT_COOLDOWN are dropped first, so this only helps when it is longer
+DECISION_CACHE_TTL = int(os.getenv("DECISION_CACHE_TTL", "300"))
+
+# Largest request body accepted (backtest uploads included), in bytes
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+
+# Uploads at least this large are parsed and aggregated in a separate process
+# (up to BACKTEST_PROCESS_WORKERS at once) so they don't hold the GIL that the
+# worker's /tvhook threads need; 0 keeps everything in-process
+BACKTEST_PROCESS_MIN_BYTES = int(os.getenv("BACKTEST_PROCESS_MIN_BYTES", str(2 * 1024 * 1024)))
+BACKTEST_PROCESS_WORKERS = int(os.getenv("BACKTEST_PROCESS_WORKERS", "1"))
+# Seconds to wait on that process; kept under GUNICORN_TIMEOUT so a hung child
+# fails the upload instead of getting the whole worker killed
+BACKTEST_PROCESS_TIMEOUT = float(os.getenv(
+    "BACKTEST_PROCESS_TIMEOUT", str(int(os.getenv("GUNICORN_TIMEOUT", "60")) * 0.75)
+))
 
 # Static Backtest Priors
 BACKTEST_STATS = {
@@ -29,7 +73,9 @@ BACKTEST_STATS = {
 }
 
 # UNIFIED System Prompt for Single Model and Ensemble Analysis
-SYSTEM_PROMPT = """
+# Keep this free of per-alert values: providers only reuse a cached prompt
+# prefix when it is byte-identical across requests.
+_PROMPT_ROLE = """
 You are a professional intraday AI trading assistant (small account $10–70 risk).
 
 YOUR ROLE:
@@ -42,7 +88,10 @@ ALERTS YOU ANALYZE:
 - AMD accumulation/manipulation/distribution breakouts  
 - ETF-enhanced AMD alerts (QQQ/IWM/XSP)
 - TREND ANALYSIS ALERTS (strong_bullish_trend, strong_bearish_trend, etc.)
+"""
 
+# Markdown reply format the ensemble parses; the single-model agent gets a JSON schema instead
+_PROMPT_RESPONSE_FORMAT = """
 CRITICAL RESPONSE FORMAT - USE THIS EXACT STRUCTURE:
 
 **Direction:** [LONG/SHORT/IGNORE]
@@ -64,7 +113,9 @@ CRITICAL RESPONSE FORMAT - USE THIS EXACT STRUCTURE:
 - Historical performance consideration (when available)
 - Specific reasons for entry or rejection
 - Option strategy justification]
+"""
 
+_PROMPT_RULES = """
 TRADING RULES (STRICTLY ENFORCED):
 ■ Maximum option cost = **$70**
 ■ Vertical spreads 1–5 strikes wide  
@@ -133,3 +184,34 @@ ALWAYS provide detailed notes explaining your analysis and specifically mention:
 - Trend strength assessment
 - Specific risk/reward calculation
 """
+
+SYSTEM_PROMPT = _PROMPT_ROLE + _PROMPT_RESPONSE_FORMAT + _PROMPT_RULES
+
+# Compact spec for the single-model agent; the JSON schema carries the reply format
+AGENT_SYSTEM_PROMPT = """
+Intraday options trading assistant, small account ($10-70 risk). Ultra-selective: default to ignore.
+Alerts: 3-1 inside bar breakouts, AMD breakouts (incl. ETF-enhanced QQQ/IWM/XSP), trend alerts (strong_bullish_trend etc).
+
+Approve long/short only if ALL hold:
+1. Clear directional bias confirmed at a key level
+2. R:R >= 1:1.5
+3. Stop logically outside key levels
+4. Option cost <= $70; 0-1 DTE; verticals 1-5 strikes wide; 100-multiplier equity options
+Trend alerts: need price vs both EMAs, RSI (>50 bull/<50 bear), MACD and volume all aligned; fresh > extended; ETFs > single stocks.
+Trend entry on pullback to EMA; stop beyond recent swing; target prior resistance/support.
+Strength: all aligned=high, mostly aligned=medium, mixed/no volume=low (usually ignore).
+Use historical win rate and R:R when given; otherwise judge the current setup only.
+ETFs: QQQ tracks NASDAQ, IWM small-cap/economy sensitive, XSP broad market, lower vol.
+
+notes: 1-2 short sentences, under 300 characters - key aligned/conflicting signals, R:R, reason to take or reject.
+Prices as plain numbers or null; options as "strike/expiry" or "n/a".
+"""
+# Single-model reply cap: the schema's fields filled in (~80 tokens, rounded up)
+# plus the notes budget; a reply that hits the cap is dropped as an OpenAI error
+AGENT_FIELDS_TOKENS = 100
+AGENT_NOTES_TOKENS = int(os.getenv("AGENT_NOTES_TOKENS", "100"))
+AGENT_MAX_TOKENS = AGENT_FIELDS_TOKENS + AGENT_NOTES_TOKENS
+
+# Ensemble replies: the markdown fields plus a short Notes section; anything past
+# ~400 chars of reasoning is cut off when the reply is parsed
+ENSEMBLE_MAX_TOKENS = int(os.getenv("ENSEMBLE_MAX_TOKENS", "450"))
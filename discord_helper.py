@@ -1,85 +1,39 @@
-import requests
-import datetime
-import json
+import logging
+import asyncio
+import httpx
+import orjson
 import os
-from helpers import _to_float
+from helpers import _to_float, TREND_STRATEGY_RE
 from config import DISCORD_WEBHOOK_URL
-from datetime import datetime
+from async_loop import get_http_client
 
-def make_discord_embed(alert_data, agent_reply):
-    """Generate a clean Discord embed with option suggestions."""
-    if isinstance(agent_reply, str):
-        try:
-            agent = json.loads(agent_reply)
-        except Exception:
-            agent = {}
-    else:
-        agent = agent_reply or {}
+logger = logging.getLogger(__name__)
 
-    direction = (agent.get("direction") or "ignore").lower()
-    confidence = (agent.get("confidence") or "low").lower()
+# Webhook posts give up quickly so a hung Discord endpoint can't hold up the loop
+DISCORD_TIMEOUT = httpx.Timeout(5.0, connect=2.0)
+DISCORD_MAX_ATTEMPTS = 3
 
-    # Colors and emojis
-    if direction == "long":
-        emoji = "🟢"; color = 0x00ff00
-    elif direction == "short":
-        emoji = "🔴"; color = 0xff0000
-    else:
-        emoji = "🟡"; color = 0xffff00
+# (emoji, color) for send_to_discord alerts: green long/bullish, red short/bearish, gray otherwise
+_ALERT_STYLE = {"LONG": ("🟢", 3066993), "SHORT": ("🔴", 15158332)}
+_NEUTRAL_STYLE = ("⚫", 10181046)
 
-    conf_emoji = {"high": "🎯", "medium": "⚠️", "low": "🔍"}.get(confidence, "❓")
-    ticker = alert_data.get("ticker", "UNKNOWN")
-    interval = alert_data.get("interval", "?")
-    pattern = alert_data.get("pattern", "?")
+# (name, inline) of the fixed embed fields, zipped with each alert's values
+_ALERT_FIELDS = (("Strategy", True), ("Direction", True), ("Confidence", True), ("Current Price", True))
 
-    def fmt(v):
-        return f"${v:,.2f}" if isinstance(v, (float, int)) else "n/a"
-
-    # Build fields
-    fields = []
-    
-    # Details section
-    detail_text = f"**Timeframe:** {interval}\n**Current Price:** {fmt(_to_float(alert_data.get('close')))}"
-    if alert_data.get('ib_high'):
-        detail_text += f"\n**IB High:** {fmt(_to_float(alert_data.get('ib_high')))}\n**IB Low:** {fmt(_to_float(alert_data.get('ib_low')))}"
-    if alert_data.get('box_high'):
-        detail_text += f"\n**Box High:** {fmt(_to_float(alert_data.get('box_high')))}\n**Box Low:** {fmt(_to_float(alert_data.get('box_low')))}"
-        
-    fields.append({"name": "📊 Details", "value": detail_text, "inline": False})
-    
-    # Recommendation section
-    fields.append({
-        "name": "🎯 Recommendation",
-        "value": f"**Direction:** {direction.upper()}\n**Confidence:** {conf_emoji} {confidence.upper()}\n**Entry:** {fmt(agent.get('entry'))}\n**Stop:** {fmt(agent.get('stop'))}\n**TP1:** {fmt(agent.get('tp1'))}\n**TP2:** {fmt(agent.get('tp2'))}\n**Single Option:** {agent.get('single_option')}\n**Vertical Spread:** {agent.get('vertical_spread')}",
-        "inline": False
-    })
-    
-    # Notes section
-    fields.append({"name": "📝 Notes", "value": agent.get("notes", "n/a"), "inline": False})
-
-    embed = {
-        "title": f"{emoji} {ticker} {pattern}",
-        "color": color,
-        "fields": fields,
-        "footer": {"text": "TradingView AI Agent"},
-        "timestamp": datetime.datetime.utcnow().isoformat()
-    }
-    return {"embeds": [embed]}
-
-def send_to_discord(alert_data, ai_response, webhook_url=None):
+async def send_to_discord(alert_data, ai_response, webhook_url=None):
     """Send trading alert to Discord with clean formatting"""
     try:
         if webhook_url is None:
             webhook_url = os.environ.get("DISCORD_WEBHOOK_URL")
             
         if not webhook_url:
-            print("❌ No Discord webhook URL configured")
+            logger.error("❌ No Discord webhook URL configured")
             return False
 
         # Parse AI response
         if isinstance(ai_response, str):
             try:
-                response_data = json.loads(ai_response)
+                response_data = orjson.loads(ai_response)
             except:
                 response_data = {"direction": "unknown", "confidence": "unknown", "notes": ai_response}
         else:
@@ -92,55 +46,33 @@ def send_to_discord(alert_data, ai_response, webhook_url=None):
         confidence = response_data.get("confidence", "low").upper()
         
         # ✅ ADDED: Different formatting for trend alerts vs breakout alerts
-        if any(x in strategy for x in ['bullish_trend', 'bearish_trend']):
+        if TREND_STRATEGY_RE.search(strategy):
             title = f"📈 TREND ALERT: {ticker}"
-            # Green for bullish, Red for bearish, Yellow for ignore
-            if 'bullish' in strategy:
-                color = 3066993  # Green
-                emoji = "🟢"
-            elif 'bearish' in strategy: 
-                color = 15158332  # Red
-                emoji = "🔴"
-            else:
-                color = 10181046  # Gray
-                emoji = "⚫"
+            # Trend alerts are styled by the trend itself, breakouts by the decision
+            side = "LONG" if 'bullish' in strategy else "SHORT" if 'bearish' in strategy else None
         else:
             title = f"🔔 BREAKOUT ALERT: {ticker}"
-            # Use existing color scheme for breakouts
-            color = 3066993 if direction == "LONG" else 15158332 if direction == "SHORT" else 10181046
-            emoji = "🟢" if direction == "LONG" else "🔴" if direction == "SHORT" else "⚫"
+            side = direction
+        emoji, color = _ALERT_STYLE.get(side, _NEUTRAL_STYLE)
 
         # Create simple embed without complex fields that might cause issues
         embed = {
             "title": title,
             "color": color,
             "fields": [
-                {
-                    "name": "Strategy",
-                    "value": strategy,
-                    "inline": True
-                },
-                {
-                    "name": "Direction",
-                    "value": f"{emoji} {direction}",
-                    "inline": True
-                },
-                {
-                    "name": "Confidence", 
-                    "value": confidence,
-                    "inline": True
-                },
-                {
-                    "name": "Current Price",
-                    "value": f"${alert_data.get('price', alert_data.get('close', 'N/A'))}",
-                    "inline": True
-                }
+                {"name": name, "value": value, "inline": inline}
+                for (name, inline), value in zip(_ALERT_FIELDS, (
+                    strategy,
+                    f"{emoji} {direction}",
+                    confidence,
+                    f"${alert_data.get('price', alert_data.get('close', 'N/A'))}"
+                ))
             ],
             "timestamp": alert_data.get("timestamp", "")
         }
 
         # ✅ ADDED: Include trend-specific data if available
-        additional_data = alert_data.get('additional_data', {})
+        additional_data = alert_data.get('additional_data') or {}
         if additional_data:
             trend_info = []
             
@@ -188,20 +120,35 @@ def send_to_discord(alert_data, ai_response, webhook_url=None):
             "avatar_url": "https://img.icons8.com/color/96/000000/stock-share.png"
         }
 
-        response = requests.post(
-            webhook_url,
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            timeout=10
-        )
+        # Serialize once with orjson and reuse the bytes across retries
+        body = orjson.dumps(payload)
+        for attempt in range(DISCORD_MAX_ATTEMPTS):
+            response = await get_http_client().post(
+                webhook_url,
+                content=body,
+                headers={"Content-Type": "application/json"},
+                timeout=DISCORD_TIMEOUT
+            )
+            
+            if response.status_code == 204:
+                logger.info("✅ Sent to Discord: %s %s %s", ticker, strategy, direction)
+                return True
+            
+            # Rate limited: Discord says how long to wait. Server errors: back off.
+            if response.status_code == 429:
+                delay = _to_float(response.headers.get("Retry-After"), 1.0)
+            elif response.status_code >= 500:
+                delay = 0.2 * 2 ** attempt
+            else:
+                break
+            
+            if attempt + 1 < DISCORD_MAX_ATTEMPTS:
+                logger.warning("⚠️ Discord returned %s, retrying in %.1fs", response.status_code, delay)
+                await asyncio.sleep(delay)
         
-        if response.status_code == 204:
-            print(f"✅ Sent to Discord: {ticker} {strategy} {direction}")
-            return True
-        else:
-            print(f"❌ Discord error {response.status_code}: {response.text}")
-            return False
+        logger.error("❌ Discord error %s: %s", response.status_code, response.text)
+        return False
 
     except Exception as e:
-        print(f"❌ Discord send error: {e}")
+        logger.error("❌ Discord send error: %s", e)
         return False
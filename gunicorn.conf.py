@@ -0,0 +1,17 @@
+import os
+
+# Production server config: gunicorn -c gunicorn.conf.py app:app
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+
+# Threaded workers: webhook handlers mostly wait on LLM and Discord I/O
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+# gthread caps open client connections per worker, keep-alive ones included
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000"))
+# /tvhook answers before the agent runs, so only /backtest uploads need long
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+keepalive = 5
+
+# Don't preload: each worker starts its own async loop thread after the fork
+preload_app = False
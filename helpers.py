@@ -1,9 +1,22 @@
-import json
+import logging
+import mmap
+import orjson
 import os
+import re
+import time
+import threading
 import datetime
+from collections import OrderedDict
 from datetime import timezone
 from supabase import create_client, Client
-from config import BACKTEST_MEMORY_FILE, BACKTEST_STATS
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, fine for a single dev-server process
+    fcntl = None
+from config import (BACKTEST_MEMORY_FILE, BACKTEST_STATS, MIN_IB_RANGE_PCT, MAX_IB_RANGE_PCT,
+                    HIST_MIN_TRADES, HIST_MIN_WINRATE, HIST_MIN_AVG_RR)
+
+logger = logging.getLogger(__name__)
 
 # Initialize Supabase client from environment variables
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
@@ -12,32 +25,305 @@ SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 if SUPABASE_URL and SUPABASE_KEY:
     supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 else:
-    print("⚠️ Supabase credentials not found in environment variables")
+    logger.warning("⚠️ Supabase credentials not found in environment variables")
     supabase = None
 
+# Drops "%" signs and spaces in one pass; float() ignores other surrounding whitespace
+_PCT_AND_SPACES = str.maketrans("", "", "% ")
+
 def _to_float(v, default=None):
+    # JSON numbers need no string round trip; exact type checks also keep bools
+    # unparseable, as before (other numeric types still parse via str below)
+    kind = type(v)
+    if kind is float:
+        return v
+    if kind is int:
+        return float(v)
+    if v is None:
+        return default
+    text = (v if isinstance(v, str) else str(v)).translate(_PCT_AND_SPACES).strip()
+    # Blank cells are common; answering them here skips a raised ValueError
+    if not text:
+        return default
     try:
-        if v is None or v == "":
-            return default
-        return float(str(v).replace("%", "").strip())
-    except Exception:
+        return float(text)
+    except ValueError:
         return default
 
-def load_backtest_memory():
-    if not os.path.exists(BACKTEST_MEMORY_FILE):
-        return {}
+# Trend analysis strategies, e.g. "strong_bullish_trend"
+TREND_STRATEGY_RE = re.compile(r"bullish_trend|bearish_trend")
+# 3-1 inside bar breakout patterns, e.g. "3-1_breakout_long"
+INSIDE_BAR_PATTERN_RE = re.compile(r"3-1")
+
+# Fields of the markdown reply format in SYSTEM_PROMPT, shared by the ensemble and the DB save
+DIRECTION_RE = re.compile(r'(?:\*\*)?(?:Direction|Decision):(?:\*\*)?\s*(LONG|SHORT|IGNORE)', re.IGNORECASE)
+CONFIDENCE_RE = re.compile(r'(?:\*\*)?Confidence:(?:\*\*)?\s*(LOW|MEDIUM|HIGH)', re.IGNORECASE)
+NOTES_HEADER_RE = re.compile(r'.*(Notes|Reasoning|Analysis|###):', re.IGNORECASE)
+_NOTES_SECTION_RE = re.compile(r'### Notes\s*(.+?)(?=\n#|\n\*\*|\n###|\n$)', re.DOTALL)
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire ttl seconds after being stored."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+def decision_fingerprint(alert_data):
+    """Cache key for agent decisions: the alert's identity plus its prices rounded to the cent."""
+    def cents(v):
+        f = _to_float(v)
+        return None if f is None else round(f, 2)
+
+    additional_data = alert_data.get("additional_data") or {}
+    return (
+        str(alert_data.get("ticker", alert_data.get("symbol", ""))).upper(),
+        str(alert_data.get("interval", "")),
+        str(alert_data.get("strategy", "")),
+        str(alert_data.get("pattern", "")),
+        cents(alert_data.get("ib_high")),
+        cents(alert_data.get("ib_low")),
+        cents(alert_data.get("price", alert_data.get("close"))),
+        orjson.dumps(
+            {k: round(v, 2) if isinstance(v, float) else v for k, v in additional_data.items()},
+            option=orjson.OPT_SORT_KEYS
+        )
+    )
+
+# Numeric alert fields that normalize_alert coerces to floats
+_ALERT_NUMERIC_FIELDS = ("close", "price", "ib_high", "ib_low", "box_high", "box_low", "atr")
+
+def normalize_alert(data):
+    """Copy of a parsed alert with the ticker/pattern cleaned up and numeric fields as floats (None if unparseable)."""
+    alert = dict(data)
+    alert["ticker"] = str(data.get("ticker", data.get("symbol", "UNKNOWN"))).strip().upper()
+    if "pattern" in data:
+        alert["pattern"] = str(data["pattern"]).strip()
+    for field in _ALERT_NUMERIC_FIELDS:
+        if field in data:
+            alert[field] = _to_float(data[field])
+    return alert
+
+def screen_alert(alert_data):
+    """Return why a normalized alert can be ignored without asking the agent, or None if it needs a decision."""
+    # Patterns with a well-sampled, clearly losing history on this ticker
+    hist = get_backtest_stats(alert_data["ticker"], alert_data.get("pattern", ""))
+    if hist and (hist.get("total_trades") or 0) >= HIST_MIN_TRADES:
+        winrate = hist.get("winrate_pct") or 0
+        avg_rr = hist.get("avg_rr") or 0
+        if winrate < HIST_MIN_WINRATE and avg_rr < HIST_MIN_AVG_RR:
+            return f"History filter: {winrate}% win rate and {avg_rr} avg R:R over {hist['total_trades']} trades"
+
+    ib_high = alert_data.get("ib_high")
+    ib_low = alert_data.get("ib_low")
+    if ib_high is None or ib_low is None:
+        # A 3-1 breakout can't be judged without its inside bar; other alerts don't carry one
+        if INSIDE_BAR_PATTERN_RE.search(str(alert_data.get("pattern") or alert_data.get("strategy") or "")):
+            return "Range filter: 3-1 alert without usable inside bar high/low"
+        return None
+    if ib_high <= ib_low:
+        return f"Range filter: inside bar high {ib_high} is not above its low {ib_low}"
+
+    price = alert_data.get("close", alert_data.get("price"))
+    if not price:
+        return None
+
+    ib_range_pct = (ib_high - ib_low) / price
+    if ib_range_pct < MIN_IB_RANGE_PCT:
+        return f"Range filter: inside bar range is {ib_range_pct:.3%} of price, too tight for a clean breakout"
+    if ib_range_pct > MAX_IB_RANGE_PCT:
+        return f"Range filter: inside bar range is {ib_range_pct:.2%} of price, too wide for a 1:1.5 R:R within risk limits"
+    return None
+
+def ignore_decision(notes):
+    """Agent-shaped IGNORE decision for alerts settled without a model call."""
+    return {
+        "direction": "ignore",
+        "confidence": "low",
+        "entry": None,
+        "stop": None,
+        "tp1": None,
+        "tp2": None,
+        "single_option": "n/a",
+        "vertical_spread": "n/a",
+        "notes": notes
+    }
+
+def parse_alert(raw):
+    """Decode a TradingView webhook body, rejecting payloads that are not alert objects."""
+    data = orjson.loads(raw)
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+    additional_data = data.get("additional_data")
+    if additional_data is not None and not isinstance(additional_data, dict):
+        raise ValueError("additional_data must be a JSON object")
+    return data
+
+# Backtest memory is an append-only JSONL log: each line is a {"TICKER:pattern": stats}
+# object and later lines win. Readers keep the merged dict plus how far into the file
+# they have read, so picking up another worker's upload only parses the new lines.
+_MEM_CACHE = {}
+_MEM_FILE_ID = False   # (st_dev, st_ino) of the log the cache was built from; None if absent
+_MEM_OFFSET = 0        # bytes of the log merged into _MEM_CACHE
+_MEM_LINES = 0         # lines of the log merged into _MEM_CACHE
+_MEM_LOCK = threading.RLock()
+
+# Larger unread tails are scanned straight from a read-only mapping
+_MMAP_MIN_BYTES = 64 * 1024
+
+# Rewrite the log as one line per key once it holds this many lines per key
+_COMPACT_RATIO = 10
+
+# Pre-JSONL memory file, merged in when the log doesn't exist yet
+_LEGACY_MEMORY_FILE = "backtest_memory.json"
+
+def _read_legacy_memory():
     try:
-        with open(BACKTEST_MEMORY_FILE, "r") as f:
-            return json.load(f)
-    except:
+        with open(_LEGACY_MEMORY_FILE, "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
         return {}
 
-def save_backtest_memory(mem):
+def _iter_lines(f, offset, size):
+    if size - offset < _MMAP_MIN_BYTES:
+        f.seek(offset)
+        yield from f
+        return
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        mm.seek(offset)
+        yield from iter(mm.readline, b"")
+
+def _read_memory_tail(size):
+    """Merge the complete lines appended since _MEM_OFFSET into a new _MEM_CACHE."""
+    global _MEM_CACHE, _MEM_OFFSET, _MEM_LINES
+    # Position is only committed after the merge, so a failed read is retried in full
+    offset, lines = _MEM_OFFSET, _MEM_LINES
+    updates = {}
+    with open(BACKTEST_MEMORY_FILE, "rb") as f:
+        for line in _iter_lines(f, offset, size):
+            # A line still being written is picked up on a later read
+            if not line.endswith(b"\n"):
+                break
+            try:
+                rec = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                logger.warning("⚠️ Skipping corrupt backtest memory line at byte %s", offset)
+                rec = None
+            offset += len(line)
+            lines += 1
+            if isinstance(rec, dict):
+                updates.update(rec)
+    if updates:
+        # New dict rather than in-place updates: callers may still hold the old one
+        _MEM_CACHE = {**_MEM_CACHE, **updates}
+    _MEM_OFFSET, _MEM_LINES = offset, lines
+
+def load_backtest_memory():
+    global _MEM_CACHE, _MEM_FILE_ID, _MEM_OFFSET, _MEM_LINES
     try:
-        with open(BACKTEST_MEMORY_FILE, "w") as f:
-            json.dump(mem, f, indent=2)
-    except Exception as e:
-        print("⚠️ Cannot save memory:", e)
+        st = os.stat(BACKTEST_MEMORY_FILE)
+        file_id, size = (st.st_dev, st.st_ino), st.st_size
+    except OSError:
+        file_id, size = None, 0
+    with _MEM_LOCK:
+        # A new file (compacted or replaced) or a shrunk one is read from scratch
+        if file_id != _MEM_FILE_ID or size < _MEM_OFFSET:
+            _MEM_CACHE = _read_legacy_memory() if file_id is None else {}
+            _MEM_FILE_ID, _MEM_OFFSET, _MEM_LINES = file_id, 0, 0
+        if size > _MEM_OFFSET:
+            try:
+                _read_memory_tail(size)
+            except OSError as e:
+                logger.warning("⚠️ Cannot read memory: %s", e)
+        return _MEM_CACHE
+
+def _open_memory_locked():
+    """Open the log for appending under an exclusive flock, retrying if it was compacted meanwhile."""
+    while True:
+        f = open(BACKTEST_MEMORY_FILE, "a+b")
+        if fcntl is None:
+            return f
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            st, fst = os.stat(BACKTEST_MEMORY_FILE), os.fstat(f.fileno())
+            if (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino):
+                return f
+        except OSError:
+            pass
+        f.close()
+
+def _write_memory_snapshot(mem):
+    tmp_path = BACKTEST_MEMORY_FILE + ".tmp"
+    with open(tmp_path, "wb") as f:
+        for key, result in mem.items():
+            f.write(orjson.dumps({key: result}) + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+    # Atomic swap so readers never see a half-written file
+    os.replace(tmp_path, BACKTEST_MEMORY_FILE)
+
+def save_backtest_memory(updates):
+    """Append changed {"TICKER:pattern": stats} entries to the memory log."""
+    with _MEM_LOCK:
+        try:
+            with _open_memory_locked() as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    # New log: carry over whatever the legacy file held
+                    legacy = _read_legacy_memory()
+                    if legacy:
+                        f.write(orjson.dumps(legacy) + b"\n")
+                elif os.pread(f.fileno(), 1, size - 1) != b"\n":
+                    # End a line torn by a crashed writer so ours parses on its own
+                    f.write(b"\n")
+                f.write(orjson.dumps(updates) + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+                # Catch up on our line and any other worker's, still holding the lock
+                mem = load_backtest_memory()
+                if _MEM_LINES > _COMPACT_RATIO * len(mem):
+                    _write_memory_snapshot(mem)
+                    logger.info("🗜️ Compacted backtest memory to %s entries", len(mem))
+        except Exception as e:
+            logger.warning("⚠️ Cannot save memory: %s", e)
+
+# Static priors flattened to (ticker, pattern) -> stats dict in the memory format.
+# Shared between callers, so treat the returned dicts as read-only.
+_STATIC_STATS = {
+    (ticker, pattern): {
+        "ticker": ticker,
+        "pattern": pattern,
+        "total_trades": st["trades"],
+        "winrate_pct": st["winrate"],
+        "avg_rr": st["avg_rr"],
+    }
+    for ticker, patterns in BACKTEST_STATS.items()
+    for pattern, st in patterns.items()
+}
 
 def get_backtest_stats(ticker, pattern):
     ticker = ticker.upper()
@@ -50,89 +336,17 @@ def get_backtest_stats(ticker, pattern):
         return mem[key]
 
     # 2) Fall back to static priors
-    if ticker in BACKTEST_STATS and pattern in BACKTEST_STATS[ticker]:
-        st = BACKTEST_STATS[ticker][pattern]
-        return {
-            "ticker": ticker,
-            "pattern": pattern,
-            "total_trades": st["trades"],
-            "winrate_pct": st["winrate"],
-            "avg_rr": st["avg_rr"],
-        }
-    return None
-
-def calculate_virtual_levels(alert_data, parsed_response):
-    """Calculate virtual TP/SL levels for database tracking (even for ignored trades)"""
-    try:
-        # Extract data from alert and parsed AI response
-        ticker = str(alert_data.get("ticker", "UNKNOWN")).upper()
-        pattern_name = str(alert_data.get("pattern", "")).strip()
-        current_price = _to_float(alert_data.get("close"), 0)  # Default to 0 if None
-        ib_high = _to_float(alert_data.get("ib_high"))
-        ib_low = _to_float(alert_data.get("ib_low"))
-        
-        # Parse the AI response safely
-        if isinstance(parsed_response, str):
-            try:
-                response_data = json.loads(parsed_response)
-            except:
-                response_data = {}
-        else:
-            response_data = parsed_response
-            
-        direction = response_data.get("direction", "ignore")
-        ai_entry = _to_float(response_data.get("entry"))
-        ai_tp1 = _to_float(response_data.get("tp1"))
-        ai_sl = _to_float(response_data.get("stop"))
-        
-        # Calculate IB range for risk calculation
-        ib_range = ib_high - ib_low if ib_high and ib_low else current_price * 0.01  # 1% fallback
-        
-        # If AI provided specific levels, use them
-        if ai_entry and ai_tp1 and ai_sl:
-            return float(ai_entry), float(ai_tp1), float(ai_sl)
-        
-        # For ignored trades or missing levels, calculate virtual levels
-        # ENSURE ALL RETURN VALUES ARE FLOATS, NOT None
-        if direction == "long" and ib_low and ib_high:
-            virtual_entry = float(ib_high)
-            virtual_tp1 = float(virtual_entry + ib_range) if ib_range else virtual_entry * 1.01
-            virtual_sl = float(ib_low)
-        elif direction == "short" and ib_low and ib_high:
-            virtual_entry = float(ib_low)
-            virtual_tp1 = float(virtual_entry - ib_range) if ib_range else virtual_entry * 0.99
-            virtual_sl = float(ib_high)
-        else:
-            # For ignore direction or missing data, use current price with default 1% move
-            virtual_entry = float(current_price)
-            if direction == "long":
-                virtual_tp1 = float(current_price * 1.01)
-                virtual_sl = float(current_price * 0.99)
-            elif direction == "short":
-                virtual_tp1 = float(current_price * 0.99)
-                virtual_sl = float(current_price * 1.01)
-            else:  # ignore or unknown
-                virtual_tp1 = float(current_price * 1.01)
-                virtual_sl = float(current_price * 0.99)
-        
-        return virtual_entry, virtual_tp1, virtual_sl
-        
-    except Exception as e:
-        print(f"❌ Error calculating virtual levels: {e}")
-        # Fallback to current price with safe defaults - ENSURE FLOATS
-        current_price = _to_float(alert_data.get("close"), 1.0)  # Default to 1.0 if everything fails
-        return float(current_price), float(current_price * 1.01), float(current_price * 0.99)
-
+    return _STATIC_STATS.get((ticker, pattern))
 
 def save_recommendation_to_db(alert_data, parsed_response):
     """Save trading recommendation to Supabase database for learning - IMPROVED VERSION"""
     try:
         # Check if Supabase is configured
         if not supabase:
-            print("⚠️ Supabase not configured - skipping database save")
+            logger.warning("⚠️ Supabase not configured - skipping database save")
             return {"success": False, "error": "Supabase not configured"}
         
-        print("💾 Starting database save process...")
+        logger.info("💾 Starting database save process...")
         
         # Extract basic data from alert with safe defaults
         ticker = str(alert_data.get("ticker", alert_data.get("symbol", "UNKNOWN"))).upper()
@@ -165,24 +379,23 @@ def save_recommendation_to_db(alert_data, parsed_response):
         if isinstance(parsed_response, str):
             try:
                 # Try to parse as JSON first
-                response_data = json.loads(parsed_response)
-            except json.JSONDecodeError:
+                response_data = orjson.loads(parsed_response)
+            except orjson.JSONDecodeError:
                 # If it's not JSON, try to extract from the text format
                 response_data = {}
-                import re
                 
                 # Extract direction from various formats
-                direction_match = re.search(r'\*\*Direction:\*\*\s*(LONG|SHORT|IGNORE)', parsed_response, re.IGNORECASE)
+                direction_match = DIRECTION_RE.search(parsed_response)
                 if direction_match:
                     response_data["direction"] = direction_match.group(1).upper()
                 
                 # Extract confidence from various formats
-                confidence_match = re.search(r'\*\*Confidence:\*\*\s*(LOW|MEDIUM|HIGH)', parsed_response, re.IGNORECASE)
+                confidence_match = CONFIDENCE_RE.search(parsed_response)
                 if confidence_match:
                     response_data["confidence"] = confidence_match.group(1).upper()
                 
                 # Extract notes/reasoning
-                notes_match = re.search(r'### Notes\s*(.+?)(?=\n#|\n\*\*|\n###|\n$)', parsed_response, re.DOTALL)
+                notes_match = _NOTES_SECTION_RE.search(parsed_response)
                 if notes_match:
                     response_data["notes"] = notes_match.group(1).strip()
                 else:
@@ -191,7 +404,7 @@ def save_recommendation_to_db(alert_data, parsed_response):
                     notes_lines = []
                     capture = False
                     for line in lines:
-                        if re.match(r'.*(Notes|Reasoning|Analysis|###):', line, re.IGNORECASE):
+                        if NOTES_HEADER_RE.match(line):
                             capture = True
                             continue
                         if capture and line.strip():
@@ -238,14 +451,14 @@ def save_recommendation_to_db(alert_data, parsed_response):
             "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat()  # Add timestamp
         }
         
-        print(f"🔍 Attempting database insert for {ticker} {pattern_name}...")
+        logger.info("🔍 Attempting database insert for %s %s...", ticker, pattern_name)
         
         # Test JSON serialization first
         try:
-            test_json = json.dumps(recommendation_data, default=str)
-            print(f"✅ JSON test passed: {len(test_json)} characters")
+            test_json = orjson.dumps(recommendation_data, default=str)
+            logger.info("✅ JSON test passed: %s characters", len(test_json))
         except Exception as json_error:
-            print(f"❌ JSON test failed: {json_error}")
+            logger.error("❌ JSON test failed: %s", json_error)
             # Create emergency fallback data
             recommendation_data = {
                 "symbol": ticker,
@@ -272,7 +485,7 @@ def save_recommendation_to_db(alert_data, parsed_response):
             # Check response - UPDATED FOR NEW SUPABASE CLIENT
             if hasattr(response, 'data') and response.data:
                 record_id = response.data[0].get('id', 'unknown')
-                print(f"✅ Successfully saved to database: {ticker} {pattern_name} (ID: {record_id})")
+                logger.info("✅ Successfully saved to database: %s %s (ID: %s)", ticker, pattern_name, record_id)
                 return {"success": True, "id": record_id}
             else:
                 # Handle new Supabase client error format
@@ -282,38 +495,38 @@ def save_recommendation_to_db(alert_data, parsed_response):
                 elif hasattr(response, 'status_code'):
                     error_msg = f"HTTP {response.status_code}"
                 
-                print(f"❌ Supabase error: {error_msg}")
+                logger.error("❌ Supabase error: %s", error_msg)
                 return {"success": False, "error": f"Supabase error: {error_msg}"}
                 
         except Exception as supabase_error:
-            print(f"❌ Supabase insert exception: {supabase_error}")
+            logger.error("❌ Supabase insert exception: %s", supabase_error)
             return {"success": False, "error": f"Supabase exception: {str(supabase_error)}"}
             
     except Exception as e:
-        print(f"❌ Critical error in save_recommendation_to_db: {e}")
+        logger.error("❌ Critical error in save_recommendation_to_db: %s", e)
         import traceback
-        print(f"❌ Full traceback: {traceback.format_exc()}")
+        logger.error("❌ Full traceback: %s", traceback.format_exc())
         return {"success": False, "error": f"Critical error: {str(e)}"}
 
 def test_supabase_connection():
     """Test if Supabase connection is working"""
     try:
         if not supabase:
-            print("❌ Supabase client not initialized")
+            logger.error("❌ Supabase client not initialized")
             return False
             
         # Simple test query
         response = supabase.table("trade_recommendations").select("count", count="exact").execute()
         
         if hasattr(response, 'count'):
-            print(f"✅ Supabase connection working - found {response.count} records")
+            logger.info("✅ Supabase connection working - found %s records", response.count)
             return True
         else:
-            print("❌ Supabase connection test failed")
+            logger.error("❌ Supabase connection test failed")
             return False
             
     except Exception as e:
-        print(f"❌ Supabase connection error: {e}")
+        logger.error("❌ Supabase connection error: %s", e)
         return False
         
 def get_pattern_performance(pattern_name, symbol, timeframe=5):
@@ -321,7 +534,7 @@ def get_pattern_performance(pattern_name, symbol, timeframe=5):
     try:
         # Check if Supabase is configured
         if not supabase:
-            print("⚠️ Supabase not configured - cannot fetch pattern performance")
+            logger.warning("⚠️ Supabase not configured - cannot fetch pattern performance")
             return None
             
         # Query the pattern_performance view we created
@@ -333,5 +546,5 @@ def get_pattern_performance(pattern_name, symbol, timeframe=5):
             return None
             
     except Exception as e:
-        print(f"❌ Error fetching pattern performance: {e}")
+        logger.error("❌ Error fetching pattern performance: %s", e)
         return None
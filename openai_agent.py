@@ -1,20 +1,80 @@
-import json
+import logging
+import asyncio
+import functools
+import orjson
 import os
-import httpx
 import re
-from openai import OpenAI
-from helpers import get_backtest_stats, _to_float, save_recommendation_to_db, calculate_virtual_levels
-from config import SYSTEM_PROMPT
+from openai import AsyncOpenAI
+from helpers import get_backtest_stats
+from config import AGENT_SYSTEM_PROMPT, AGENT_MAX_TOKENS, ALERT_BATCH_WINDOW, ALERT_BATCH_SIZE
+from async_loop import get_http_client, openai_limiter
 
-# Initialize OpenAI client with API key from environment
-api_key = os.environ.get("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OPENAI_API_KEY environment variable is not set")
+logger = logging.getLogger(__name__)
 
-client = OpenAI(
-    api_key=api_key,
-    http_client=httpx.Client()
+@functools.lru_cache(maxsize=None)
+def get_client():
+    """Create the OpenAI client on first use, sharing the keep-alive HTTP/2 pool
+    with the ensemble and Discord calls."""
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+    return AsyncOpenAI(api_key=api_key, http_client=get_http_client())
+
+# (alert_data, future) pairs waiting for the next batched call; created on the event loop
+_batch_queue = None
+_batch_worker = None
+# Running _decide_batch tasks; the loop only holds weak references to tasks
+_batch_tasks = set()
+
+BATCH_INSTRUCTIONS = """
+You will receive several independent trading alerts as a JSON array of analysis requests.
+Analyze each one on its own using your established criteria.
+Return exactly one decision per alert, in the same order.
+"""
+
+# Structured output schema: the API guarantees replies parse into this shape
+_PRICE_OR_NULL = {"type": ["number", "null"]}
+DECISION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "direction": {"type": "string", "enum": ["long", "short", "ignore"]},
+        "confidence": {"type": "string", "enum": ["low", "medium", "high"]},
+        "entry": _PRICE_OR_NULL,
+        "stop": _PRICE_OR_NULL,
+        "tp1": _PRICE_OR_NULL,
+        "tp2": _PRICE_OR_NULL,
+        "single_option": {"type": "string"},
+        "vertical_spread": {"type": "string"},
+        "notes": {"type": "string"}
+    },
+    "required": ["direction", "confidence", "entry", "stop", "tp1", "tp2", "single_option", "vertical_spread", "notes"],
+    "additionalProperties": False
+}
+DECISION_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "decision", "schema": DECISION_SCHEMA, "strict": True}
+}
+BATCH_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "decisions",
+        "schema": {
+            "type": "object",
+            "properties": {"decisions": {"type": "array", "items": DECISION_SCHEMA}},
+            "required": ["decisions"],
+            "additionalProperties": False
+        },
+        "strict": True
+    }
+}
+
+# Reply-parsing patterns, compiled once rather than looked up per line/reply
+_FIELD_LABEL_RE = re.compile(r'^["\*].*:')
+_FIELD_HEADER_RE = re.compile(
+    r'direction:|confidence:|entry:|stop:|tp1:|tp2:|single option:|vertical spread:', re.IGNORECASE
 )
+_JSON_OBJECT_RE = re.compile(r'\{[^{}]*\{?[^{}]*\}?[^{}]*\}', re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
 
 def extract_notes_from_text(full_text):
     """Extract meaningful notes from the AI's text response following the expected format."""
@@ -26,7 +86,7 @@ def extract_notes_from_text(full_text):
         line = line.strip()
         
         # Skip JSON-like lines and empty lines
-        if (re.match(r'^["\*].*:', line) or  # Lines with colons (field labels)
+        if (_FIELD_LABEL_RE.match(line) or  # Lines with colons (field labels)
             line.startswith('{') or 
             line.startswith('}') or
             line in ['```', '---', '***'] or
@@ -39,7 +99,7 @@ def extract_notes_from_text(full_text):
             continue
             
         # Skip confidence/direction headers but capture their content
-        if any(header in line.lower() for header in ['direction:', 'confidence:', 'entry:', 'stop:', 'tp1:', 'tp2:', 'single option:', 'vertical spread:']):
+        if _FIELD_HEADER_RE.search(line):
             # Extract the value after the colon
             if ':' in line:
                 value = line.split(':', 1)[1].strip()
@@ -70,19 +130,24 @@ def extract_notes_from_text(full_text):
     
     return notes
 
+# Defaults for every decision field; parsed replies are completed from this
+_AGENT_FALLBACK = {
+    "direction": "ignore",
+    "confidence": "low",
+    "entry": None,
+    "stop": None,
+    "tp1": None,
+    "tp2": None,
+    "single_option": "None",
+    "vertical_spread": "None",
+    "notes": ""
+}
+_VALID_DIRECTIONS = frozenset(("long", "short", "ignore"))
+_EMPTY_NOTES = frozenset(("", "n/a", "None"))
+
 def parse_structured_response(raw_text):
     """Parse the structured format from SYSTEM_PROMPT into JSON."""
-    data = {
-        "direction": "ignore",
-        "confidence": "low",
-        "entry": None,
-        "stop": None,
-        "tp1": None,
-        "tp2": None,
-        "single_option": "None",
-        "vertical_spread": "None",
-        "notes": ""
-    }
+    data = dict(_AGENT_FALLBACK)
     
     lines = raw_text.split('\n')
     current_field = None
@@ -127,7 +192,7 @@ def parse_structured_response(raw_text):
     # Extract notes using the dedicated function
     data["notes"] = extract_notes_from_text(raw_text)
     
-    return json.dumps(data)
+    return orjson.dumps(data).decode()
 
 def parse_ai_response(raw_response):
     """Parse the AI's response into structured JSON data."""
@@ -137,93 +202,45 @@ def parse_ai_response(raw_response):
             return parse_structured_response(raw_response)
         
         # Then try JSON extraction
-        json_match = re.search(r'\{[^{}]*\{?[^{}]*\}?[^{}]*\}', raw_response, re.DOTALL)
+        json_match = _JSON_OBJECT_RE.search(raw_response)
         
         if json_match:
             json_str = json_match.group()
-            json_str = re.sub(r',\s*}', '}', json_str)
-            json_str = re.sub(r',\s*]', ']', json_str)
+            json_str = _TRAILING_COMMA_RE.sub(r'\1', json_str)
             
-            data = json.loads(json_str)
+            data = orjson.loads(json_str)
+            if not isinstance(data, dict):
+                raise ValueError(f"expected a JSON object, got {type(data).__name__}")
             
-            # Ensure all required fields exist
-            required_fields = {
-                "direction": "ignore",
-                "confidence": "low", 
-                "entry": None,
-                "stop": None,
-                "tp1": None,
-                "tp2": None,
-                "single_option": "None",
-                "vertical_spread": "None",
-                "notes": extract_notes_from_text(raw_response)
-            }
-            
-            for field, default in required_fields.items():
-                if field not in data or data[field] is None:
+            # One pass fills missing fields; notes are only extracted when the reply has none
+            for field, default in _AGENT_FALLBACK.items():
+                if data.get(field) is None:
                     data[field] = default
-            
-            # Ensure notes is never empty
-            if not data.get("notes") or data["notes"] in ["n/a", "None", ""]:
+            if str(data["direction"]).lower() not in _VALID_DIRECTIONS:
+                data["direction"] = "ignore"
+            if data["notes"] in _EMPTY_NOTES:
                 data["notes"] = extract_notes_from_text(raw_response)
                 
-            return json.dumps(data)
+            return orjson.dumps(data).decode()
         else:
             # Fallback: create structured response from text
             return parse_structured_response(raw_response)
             
     except Exception as e:
-        print(f"❌ Parsing error: {e}")
+        logger.error("❌ Parsing error: %s", e)
         # Final fallback with notes extraction
-        return json.dumps({
-            "direction": "ignore",
-            "confidence": "low",
-            "entry": None,
-            "stop": None,
-            "tp1": None,
-            "tp2": None,
-            "single_option": "None",
-            "vertical_spread": "None",
-            "notes": extract_notes_from_text(raw_response)
-        })
-
-def build_agent_context(alert_data):
-    """Build context for the AI agent from alert data."""
-    ticker = str(alert_data.get("ticker", "UNKNOWN")).upper()
-    interval = str(alert_data.get("interval", ""))
-    pattern = str(alert_data.get("pattern", "")).strip()
-
-    # Extract numeric data
-    price = _to_float(alert_data.get("close"))
-    ib_high = _to_float(alert_data.get("ib_high"))
-    ib_low = _to_float(alert_data.get("ib_low"))
-    box_high = _to_float(alert_data.get("box_high"))
-    box_low = _to_float(alert_data.get("box_low"))
-    atr = _to_float(alert_data.get("atr"))
-    raw_msg = str(alert_data.get("message", ""))
-
-    # Calculate ranges and percentages
-    ib_range = ib_high - ib_low if ib_high and ib_low else None
-    range_percentage = (ib_range / price * 100) if ib_range and price else None
+        return orjson.dumps({**_AGENT_FALLBACK, "notes": extract_notes_from_text(raw_response)}).decode()
 
-    # Get historical stats
-    hist = get_backtest_stats(ticker, pattern)
-    print(f"🔍 Historical data for {ticker} {pattern}: {hist}")
-    hist_text = ""
-    if hist:
-        total_trades = hist.get('total_trades', 0)
-        winrate = hist.get('winrate_pct', 0)
-        avg_rr = hist.get('avg_rr', 0)
-        
-        hist_text = f"""
+# Agent context templates, filled with format_map per alert
+_HIST_TEMPLATE = """
 
 Historical Performance for {pattern} on {ticker}:
 - Total Trades: {total_trades}
 - Win Rate: {winrate}%
 - Average Risk/Reward: {avg_rr}
-- Edge: {'POSITIVE' if winrate > 50 and avg_rr > 1.2 else 'NEGATIVE' if winrate < 40 else 'NEUTRAL'}"""
+- Edge: {edge}"""
 
-    context = f"""
+_CONTEXT_TEMPLATE = """
 TRADING ALERT ANALYSIS REQUEST
 
 STOCK: {ticker}
@@ -234,12 +251,12 @@ CURRENT PRICE: ${price}
 KEY LEVELS:
 - Inside Bar High: ${ib_high}
 - Inside Bar Low: ${ib_low} 
-- Inside Bar Range: ${ib_range} ({range_percentage:.2f}% of price)
+- Inside Bar Range: ${ib_range} ({range_percentage}% of price)
 - ATR (Volatility): ${atr}
 - Box High: ${box_high}
 - Box Low: ${box_low}
 
-RAW ALERT: {raw_msg}
+RAW ALERT: {message}
 {hist_text}
 
 ANALYSIS INSTRUCTIONS:
@@ -251,38 +268,195 @@ ANALYSIS INSTRUCTIONS:
 
 Remember: We only take high-probability setups with clear edges.
 """
-    return context
 
-def get_agent_decision(alert_data):
+def build_agent_context(alert_data):
+    """Build context for the AI agent from a normalize_alert() dict."""
+    ticker = alert_data["ticker"]
+    pattern = alert_data.get("pattern", "")
+    price = alert_data.get("close")
+    ib_high = alert_data.get("ib_high")
+    ib_low = alert_data.get("ib_low")
+
+    # Calculate ranges and percentages
+    ib_range = ib_high - ib_low if ib_high and ib_low else None
+    range_percentage = f"{ib_range / price * 100:.2f}" if ib_range and price else "n/a"
+
+    # Get historical stats
+    hist = get_backtest_stats(ticker, pattern)
+    logger.debug("🔍 Historical data for %s %s: %s", ticker, pattern, hist)
+    hist_text = ""
+    if hist:
+        winrate = hist.get('winrate_pct') or 0
+        avg_rr = hist.get('avg_rr') or 0
+        hist_text = _HIST_TEMPLATE.format_map({
+            "pattern": pattern,
+            "ticker": ticker,
+            "total_trades": hist.get('total_trades', 0),
+            "winrate": winrate,
+            "avg_rr": avg_rr,
+            "edge": 'POSITIVE' if winrate > 50 and avg_rr > 1.2 else 'NEGATIVE' if winrate < 40 else 'NEUTRAL'
+        })
+
+    return _CONTEXT_TEMPLATE.format_map({
+        "ticker": ticker,
+        "pattern": pattern,
+        "interval": alert_data.get("interval", ""),
+        "price": price,
+        "ib_high": ib_high,
+        "ib_low": ib_low,
+        "ib_range": ib_range,
+        "range_percentage": range_percentage,
+        "atr": alert_data.get("atr"),
+        "box_high": alert_data.get("box_high"),
+        "box_low": alert_data.get("box_low"),
+        "message": alert_data.get("message", ""),
+        "hist_text": hist_text
+    })
+
+async def get_agent_decision(alert_data):
+    """Queue the alert for the next batched OpenAI call and wait for its decision."""
+    global _batch_queue, _batch_worker
+    if _batch_queue is None:
+        _batch_queue = asyncio.Queue()
+        _batch_worker = asyncio.create_task(_collect_batches())
+
+    future = asyncio.get_running_loop().create_future()
+    await _batch_queue.put((alert_data, future))
+    return await future
+
+async def _collect_batches():
+    """Group alerts that arrive within ALERT_BATCH_WINDOW and decide them together."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _batch_queue.get()]
+        deadline = loop.time() + ALERT_BATCH_WINDOW
+        while len(batch) < ALERT_BATCH_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_batch_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        task = asyncio.create_task(_decide_batch(batch))
+        _batch_tasks.add(task)
+        task.add_done_callback(_batch_tasks.discard)
+
+async def _decide_batch(batch):
+    """Resolve each alert's future, falling back to one call per alert if the batch fails."""
+    try:
+        if len(batch) == 1:
+            replies = [await get_single_decision(batch[0][0])]
+        else:
+            try:
+                replies = await get_batch_decisions([alert for alert, _ in batch])
+            except Exception as e:
+                logger.error("❌ Batch of %s failed, retrying one by one: %s", len(batch), e)
+                replies = await asyncio.gather(*(get_single_decision(alert) for alert, _ in batch))
+        for (_, future), reply in zip(batch, replies):
+            if not future.done():
+                future.set_result(reply)
+    except Exception as e:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+
+async def get_batch_decisions(alerts):
+    """Get decisions for several alerts from one OpenAI call, aligned by index."""
+    contexts = [build_agent_context(alert) for alert in alerts]
+    logger.debug("🔍 Sending batch of %s alerts to AI", len(contexts))
+
+    await openai_limiter.acquire()
+    resp = await get_client().chat.completions.create(
+        model="gpt-4o",
+        max_tokens=AGENT_MAX_TOKENS * len(contexts),
+        temperature=0.1,
+        response_format=BATCH_FORMAT,
+        extra_body={"prompt_cache_key": "tvhook-agent"},
+        messages=[
+            {"role": "system", "content": AGENT_SYSTEM_PROMPT},
+            {"role": "user", "content": BATCH_INSTRUCTIONS + orjson.dumps(contexts).decode()}
+        ]
+    )
+    if resp.usage:
+        openai_limiter.record_tokens(resp.usage.total_tokens)
+    if resp.choices[0].finish_reason == "length":
+        raise ValueError(f"batch reply cut off at {AGENT_MAX_TOKENS * len(contexts)} tokens")
+    decisions = orjson.loads(resp.choices[0].message.content)["decisions"]
+    if not isinstance(decisions, list) or len(decisions) != len(contexts):
+        raise ValueError(f"expected {len(contexts)} decisions, got {decisions!r:.200}")
+    return decisions
+
+async def read_json_object(stream):
+    """Collect streamed reply text, closing the stream as soon as the top-level JSON object is complete.
+    Raises ValueError if the reply was cut off inside the object."""
+    parts = []
+    depth = 0
+    in_string = False
+    escaped = False
+    truncated = False
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        truncated = truncated or chunk.choices[0].finish_reason == "length"
+        text = chunk.choices[0].delta.content or ""
+        for i, ch in enumerate(text):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "{":
+                depth += 1
+            elif ch == "}" and depth > 0:
+                depth -= 1
+                if depth == 0:
+                    parts.append(text[:i + 1])
+                    await stream.close()
+                    return "".join(parts)
+        parts.append(text)
+    # An unclosed object means max_tokens ran out; its fragment would only parse as a generic IGNORE
+    if depth or truncated:
+        raise ValueError(f"reply cut off at {AGENT_MAX_TOKENS} tokens")
+    return "".join(parts)
+
+async def get_single_decision(alert_data):
     """Get trading decision from OpenAI agent."""
     try:
         context = build_agent_context(alert_data)
-        print(f"🔍 Sending context to AI: {context}")
+        logger.debug("🔍 Sending context to AI: %s", context)
         
-        resp = client.chat.completions.create(
+        await openai_limiter.acquire()
+        stream = await get_client().chat.completions.create(
             model="gpt-4o",
-            max_tokens=1500,
+            max_tokens=AGENT_MAX_TOKENS,
             temperature=0.1,
+            response_format=DECISION_FORMAT,
+            extra_body={"prompt_cache_key": "tvhook-agent"},
+            stream=True,
             messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "system", "content": AGENT_SYSTEM_PROMPT},
                 {"role": "user", "content": context}
             ]
         )
-        reply_text = resp.choices[0].message.content.strip()
-        print(f"🔍 RAW AI RESPONSE: {reply_text}")
-        
-        # Parse the response before returning
-        parsed_response = parse_ai_response(reply_text)
-        print(f"🔍 PARSED RESPONSE: {parsed_response}")
+        reply_text = await read_json_object(stream)
+        # The stream is closed before any usage chunk arrives; ~4 chars per token is close enough for throttling
+        openai_limiter.record_tokens((len(AGENT_SYSTEM_PROMPT) + len(context) + len(reply_text)) // 4)
+        logger.debug("🔍 RAW AI RESPONSE: %s", reply_text)
         
-        # NEW: Save recommendation to database for learning
-        save_recommendation_to_db(alert_data, parsed_response)
-        
-        return parsed_response
+        try:
+            return orjson.loads(reply_text)
+        except (TypeError, ValueError):
+            # Refusals don't follow the schema
+            return orjson.loads(parse_ai_response(reply_text or ""))
         
     except Exception as e:
-        print("❌ OPENAI ERROR:", e)
-        error_response = json.dumps({
+        logger.error("❌ OPENAI ERROR: %s", e)
+        error_response = {
             "direction": "ignore",
             "entry": None,
             "stop": None,
@@ -292,12 +466,6 @@ def get_agent_decision(alert_data):
             "single_option": "n/a",
             "vertical_spread": "n/a",
             "notes": f"OpenAI error: {str(e)}"
-        })
-        
-        # NEW: Save error case to database too
-        try:
-            save_recommendation_to_db(alert_data, error_response)
-        except Exception as db_error:
-            print(f"❌ Failed to save error to database: {db_error}")
+        }
         
         return error_response
@@ -1,11 +1,22 @@
+import logging
 import asyncio
 import os
 import time
 from typing import List, Dict
 import re
-import json
-from openai import OpenAI
-from anthropic import Anthropic
+import orjson
+from openai import AsyncOpenAI
+from anthropic import AsyncAnthropic
+from async_loop import get_http_client, openai_limiter
+from helpers import DIRECTION_RE, CONFIDENCE_RE, NOTES_HEADER_RE
+from config import ENSEMBLE_MAX_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# Reasoning sections of a markdown reply, compiled once for every model reply
+_NOTES_SECTION_RE = re.compile(r'### Notes\s*(.+)', re.DOTALL)
+_SEPARATOR_SECTION_RE = re.compile(r'---\s*\n\s*(.+)', re.DOTALL)
+_WHITESPACE_RE = re.compile(r'\s+')
 
 class TradingEnsemble:
     def __init__(self):
@@ -16,59 +27,60 @@ class TradingEnsemble:
         try:
             openai_key = os.getenv('OPENAI_API_KEY')
             if not openai_key:
-                print("❌ OPENAI_API_KEY environment variable is not set")
+                logger.error("❌ OPENAI_API_KEY environment variable is not set")
             else:
-                self.openai_client = OpenAI(api_key=openai_key)
-                print("✅ OpenAI client initialized successfully")
+                self.openai_client = AsyncOpenAI(api_key=openai_key, http_client=get_http_client())
+                logger.info("✅ OpenAI client initialized successfully")
         except Exception as e:
-            print(f"❌ Failed to initialize OpenAI client: {e}")
+            logger.error("❌ Failed to initialize OpenAI client: %s", e)
             
         try:
             anthropic_key = os.getenv('ANTHROPIC_API_KEY')
             if not anthropic_key:
-                print("❌ ANTHROPIC_API_KEY environment variable is not set")
+                logger.error("❌ ANTHROPIC_API_KEY environment variable is not set")
             else:
-                self.anthropic_client = Anthropic(api_key=anthropic_key)
-                print("✅ Anthropic client initialized successfully")
+                self.anthropic_client = AsyncAnthropic(api_key=anthropic_key, http_client=get_http_client())
+                logger.info("✅ Anthropic client initialized successfully")
         except Exception as e:
-            print(f"❌ Failed to initialize Anthropic client: {e}")
+            logger.error("❌ Failed to initialize Anthropic client: %s", e)
         
         # Model configurations with weights
         self.models = {
-            "gpt-4o": {"weight": 1.0, "client": "openai"},
-            "gpt-4-turbo": {"weight": 0.9, "client": "openai"}, 
-            "claude-3-5-sonnet-20241022": {"weight": 0.95, "client": "anthropic"}
+            "gpt-4o": {"weight": 1.0, "client": "openai", "display_name": "GPT-4o"},
+            "gpt-4-turbo": {"weight": 0.9, "client": "openai", "display_name": "GPT-4 Turbo"}, 
+            "claude-3-5-sonnet-20241022": {"weight": 0.95, "client": "anthropic", "display_name": "Claude 3.5"}
         }
         
         # ✅ USE YOUR EXISTING SYSTEM PROMPT FROM CONFIG
         try:
             from config import SYSTEM_PROMPT
             self.system_prompt = SYSTEM_PROMPT
-            print("✅ System prompt loaded successfully")
+            logger.info("✅ System prompt loaded successfully")
         except ImportError:
-            print("❌ Failed to import SYSTEM_PROMPT from config")
+            logger.error("❌ Failed to import SYSTEM_PROMPT from config")
             self.system_prompt = "You are a trading analyst. Analyze the trading alert and provide your decision."
         except Exception as e:
-            print(f"❌ Error loading system prompt: {e}")
+            logger.error("❌ Error loading system prompt: %s", e)
             self.system_prompt = "You are a trading analyst. Analyze the trading alert and provide your decision."
 
     async def get_ensemble_decision(self, alert_data):
         """Get decisions from all 3 models and return consensus"""
-        print("🚀 Starting ensemble decision process with 3 models...")
+        logger.info("🚀 Starting ensemble decision process with 3 models...")
         
         context = self._build_context(alert_data)
         
-        # Get decisions from all models in parallel
+        # Get decisions from all models in parallel - the async clients let
+        # gather overlap the three API round-trips instead of running them in turn
         tasks = []
         for model_name in self.models:
             task = self._get_single_model_decision(model_name, context)
             tasks.append(task)
         
-        print("🔄 Waiting for all 3 models to respond...")
+        logger.info("🔄 Waiting for all 3 models to respond...")
         start_time = time.time()
         results = await asyncio.gather(*tasks, return_exceptions=True)
         end_time = time.time()
-        print(f"⏱️ All models completed in {end_time - start_time:.2f} seconds")
+        logger.info("⏱️ All models completed in %.2f seconds", end_time - start_time)
         
         # Analyze consensus with detailed debugging
         final_decision = self._analyze_consensus(results)
@@ -76,7 +88,7 @@ class TradingEnsemble:
 
     async def _get_single_model_decision(self, model: str, context: str):
         """Get decision from a single model"""
-        print(f"🔍 Querying {model}...")
+        logger.debug("🔍 Querying %s...", model)
         
         try:
             # Check if client is available
@@ -90,7 +102,7 @@ class TradingEnsemble:
                 return await self._get_anthropic_decision(model, context)
                 
         except Exception as e:
-            print(f"❌ {model} error: {str(e)}")
+            logger.error("❌ %s error: %s", model, e)
             return {
                 "model": model,
                 "direction": "IGNORE", 
@@ -103,37 +115,45 @@ class TradingEnsemble:
     async def _get_openai_decision(self, model: str, context: str):
         """Get decision from OpenAI model"""
         try:
-            resp = self.openai_client.chat.completions.create(
+            await openai_limiter.acquire()
+            resp = await self.openai_client.chat.completions.create(
                 model=model,
-                max_tokens=1000,
+                max_tokens=ENSEMBLE_MAX_TOKENS,
                 temperature=0.1,
+                # Route every alert to the same prompt cache for the shared system prompt
+                extra_body={"prompt_cache_key": "tvhook-ensemble"},
                 messages=[
                     {"role": "system", "content": self.system_prompt},
                     {"role": "user", "content": context}
                 ]
             )
             response_text = resp.choices[0].message.content
-            print(f"✅ {model} responded successfully")
+            if resp.usage:
+                openai_limiter.record_tokens(resp.usage.total_tokens)
+            cached = getattr(resp.usage.prompt_tokens_details, "cached_tokens", 0) if resp.usage and resp.usage.prompt_tokens_details else 0
+            logger.info("✅ %s responded successfully (cached prompt tokens: %s)", model, cached)
             return self._parse_decision(response_text, model)
         except Exception as e:
-            print(f"❌ {model} API error: {e}")
+            logger.error("❌ %s API error: %s", model, e)
             raise
 
     async def _get_anthropic_decision(self, model: str, context: str):
         """Get decision from Anthropic model"""
         try:
-            message = self.anthropic_client.messages.create(
+            message = await self.anthropic_client.messages.create(
                 model=model,
-                max_tokens=1000,
+                max_tokens=ENSEMBLE_MAX_TOKENS,
                 temperature=0.1,
-                system=self.system_prompt,
+                # The system prompt never changes, so mark it cacheable
+                system=[{"type": "text", "text": self.system_prompt, "cache_control": {"type": "ephemeral"}}],
                 messages=[{"role": "user", "content": context}]
             )
             response_text = message.content[0].text
-            print(f"✅ {model} responded successfully")
+            cached = getattr(message.usage, "cache_read_input_tokens", 0) or 0
+            logger.info("✅ %s responded successfully (cached prompt tokens: %s)", model, cached)
             return self._parse_decision(response_text, model)
         except Exception as e:
-            print(f"❌ {model} API error: {e}")
+            logger.error("❌ %s API error: %s", model, e)
             raise
 
     def _build_context(self, alert_data):
@@ -144,9 +164,10 @@ class TradingEnsemble:
         price = alert_data.get('price') or alert_data.get('close') or alert_data.get('current_price') or 'N/A'
         
         # Additional data that might be useful
-        additional_data = alert_data.get('additional_data', {})
+        additional_data = alert_data.get('additional_data') or {}
         
-        # Build context that works with your existing system prompt
+        # Build context that works with your existing system prompt. Everything
+        # alert-specific goes here so the system prompt prefix stays cacheable.
         context = f"""
 TRADING ALERT RECEIVED:
 
@@ -155,7 +176,7 @@ STRATEGY: {strategy}
 CURRENT PRICE: ${price}
 
 ADDITIONAL DATA:
-{json.dumps(additional_data, indent=2) if additional_data else 'No additional data'}
+{orjson.dumps(additional_data).decode() if additional_data else 'No additional data'}
 
 Please analyze this trading alert using your established criteria and provide your decision in the required format.
 """
@@ -166,42 +187,32 @@ Please analyze this trading alert using your established criteria and provide yo
         try:
             # Clean the response
             response = response.strip()
-            print(f"📝 {model} raw response length: {len(response)} chars")
+            logger.debug("📝 %s raw response length: %s chars", model, len(response))
             
             # Extract direction with multiple patterns for your format
             direction = "IGNORE"
-            for pattern in [r'\*\*Direction:\*\*\s*(LONG|SHORT|IGNORE)', 
-                           r'Direction:\s*(LONG|SHORT|IGNORE)',
-                           r'DIRECTION:\s*(LONG|SHORT|IGNORE)',
-                           r'Decision:\s*(LONG|SHORT|IGNORE)',
-                           r'\*\*Decision:\*\*\s*(LONG|SHORT|IGNORE)']:
-                match = re.search(pattern, response, re.IGNORECASE)
-                if match:
-                    direction = match.group(1).upper()
-                    print(f"🎯 {model} direction: {direction}")
-                    break
+            match = DIRECTION_RE.search(response)
+            if match:
+                direction = match.group(1).upper()
+                logger.debug("🎯 %s direction: %s", model, direction)
             
             # Extract confidence with multiple patterns for your format
             confidence = "LOW"
-            for pattern in [r'\*\*Confidence:\*\*\s*(LOW|MEDIUM|HIGH)',
-                           r'Confidence:\s*(LOW|MEDIUM|HIGH)',
-                           r'CONFIDENCE:\s*(LOW|MEDIUM|HIGH)']:
-                match = re.search(pattern, response, re.IGNORECASE)
-                if match:
-                    confidence = match.group(1).upper()
-                    print(f"📊 {model} confidence: {confidence}")
-                    break
+            match = CONFIDENCE_RE.search(response)
+            if match:
+                confidence = match.group(1).upper()
+                logger.debug("📊 %s confidence: %s", model, confidence)
             
             # Extract reasoning - look for Notes section or everything after the main format
             reasoning = "No reasoning provided"
             
             # Try to extract from Notes section first (your format)
-            notes_match = re.search(r'### Notes\s*(.+)', response, re.DOTALL)
+            notes_match = _NOTES_SECTION_RE.search(response)
             if notes_match:
                 reasoning = notes_match.group(1).strip()
             else:
                 # Try to extract from --- separator (your format)
-                separator_match = re.search(r'---\s*\n\s*(.+)', response, re.DOTALL)
+                separator_match = _SEPARATOR_SECTION_RE.search(response)
                 if separator_match:
                     reasoning = separator_match.group(1).strip()
                 else:
@@ -210,7 +221,7 @@ Please analyze this trading alert using your established criteria and provide yo
                     reasoning_lines = []
                     capture = False
                     for line in lines:
-                        if re.match(r'.*(Notes|Reasoning|Analysis|###):', line, re.IGNORECASE):
+                        if NOTES_HEADER_RE.match(line):
                             capture = True
                             continue
                         if capture and line.strip():
@@ -220,14 +231,15 @@ Please analyze this trading alert using your established criteria and provide yo
                         reasoning = ' '.join(reasoning_lines).strip()
             
             # Clean up reasoning
-            reasoning = re.sub(r'\s+', ' ', reasoning).strip()
+            reasoning = _WHITESPACE_RE.sub(' ', reasoning).strip()
             if len(reasoning) > 400:
                 reasoning = reasoning[:397] + "..."
                 
-            print(f"💭 {model} reasoning extracted: {len(reasoning)} chars")
+            logger.debug("💭 %s reasoning extracted: %s chars", model, len(reasoning))
                 
             return {
                 "model": model,
+                "display_name": self.models[model]["display_name"],
                 "direction": direction,
                 "confidence": confidence,
                 "reasoning": reasoning,
@@ -235,7 +247,7 @@ Please analyze this trading alert using your established criteria and provide yo
                 "error": False
             }
         except Exception as e:
-            print(f"❌ {model} parse error: {e}")
+            logger.error("❌ %s parse error: %s", model, e)
             return {
                 "model": model,
                 "direction": "IGNORE",
@@ -247,28 +259,28 @@ Please analyze this trading alert using your established criteria and provide yo
 
     def _analyze_consensus(self, results: List[Dict]) -> Dict:
         """Analyze multiple model decisions and return consensus"""
-        print("\n" + "="*50)
-        print("🤖 ENSEMBLE CONSENSUS ANALYSIS")
-        print("="*50)
+        logger.info("\n" + "=" * 50)
+        logger.info("🤖 ENSEMBLE CONSENSUS ANALYSIS")
+        logger.info("=" * 50)
         
         # DEBUG: Check what models actually returned
-        print(f"📊 Raw results received: {len(results)}")
+        logger.info("📊 Raw results received: %s", len(results))
         for i, result in enumerate(results):
             if isinstance(result, Exception):
-                print(f"❌ Model {i} raised exception: {result}")
+                logger.error("❌ Model %s raised exception: %s", i, result)
             elif isinstance(result, dict):
                 status = "✅" if not result.get('error', False) else "⚠️"
-                print(f"{status} {result.get('model', 'Unknown')}: {result.get('direction', 'ERROR')} (Confidence: {result.get('confidence', 'UNKNOWN')})")
+                logger.info("%s %s: %s (Confidence: %s)", status, result.get('model', 'Unknown'), result.get('direction', 'ERROR'), result.get('confidence', 'UNKNOWN'))
                 if result.get('error', False):
-                    print(f"   Error details: {result.get('reasoning', 'No details')}")
+                    logger.info("   Error details: %s", result.get('reasoning', 'No details'))
             else:
-                print(f"⚠️ Model {i} returned unexpected type: {type(result)}")
+                logger.warning("⚠️ Model %s returned unexpected type: %s", i, type(result))
         
         valid_results = [r for r in results if isinstance(r, dict) and not r.get('error', False)]
-        print(f"\n🎯 Valid results: {len(valid_results)}/3 models")
+        logger.info("\n🎯 Valid results: %s/3 models", len(valid_results))
         
         if not valid_results:
-            print("❌ CRITICAL: All models failed!")
+            logger.error("❌ CRITICAL: All models failed!")
             return {
                 "direction": "IGNORE", 
                 "confidence": "LOW", 
@@ -284,7 +296,7 @@ Please analyze this trading alert using your established criteria and provide yo
         total_weighted_confidence = 0
         total_weights = 0
         
-        print("\n📈 Model Breakdown:")
+        logger.info("\n📈 Model Breakdown:")
         for result in valid_results:
             direction = result["direction"]
             confidence = result["confidence"]
@@ -294,7 +306,7 @@ Please analyze this trading alert using your established criteria and provide yo
             total_weighted_confidence += confidence_scores.get(confidence, 0) * weight
             total_weights += weight
             
-            print(f"   - {result['model']}: {direction} (Confidence: {confidence}, Weight: {weight})")
+            logger.info("   - %s: %s (Confidence: %s, Weight: %s)", result['model'], direction, confidence, weight)
         
         # Determine consensus direction (majority rule)
         consensus_direction = max(direction_counts.items(), key=lambda x: x[1])[0]
@@ -314,8 +326,8 @@ Please analyze this trading alert using your established criteria and provide yo
         reasoning += ", ".join([f"{dir}: {count}" for dir, count in direction_counts.items()])
         reasoning += f"). Confidence: {consensus_confidence}"
         
-        print(f"\n🏁 FINAL CONSENSUS: {consensus_direction} (Confidence: {consensus_confidence})")
-        print(f"   Breakdown: {direction_counts}")
+        logger.info("\n🏁 FINAL CONSENSUS: %s (Confidence: %s)", consensus_direction, consensus_confidence)
+        logger.info("   Breakdown: %s", direction_counts)
         
         return {
             "direction": consensus_direction,